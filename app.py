@@ -1,16 +1,26 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
 import os
 import re
 import json
-import time
+import gzip
+import hmac
 import base64
+import bisect
+import random
 import shutil
+import signal
+import hashlib
 import asyncio
-import requests
-import platform
-import subprocess
 import threading
+import http.client
 from threading import Thread
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http import HTTPStatus
+from collections import namedtuple
+from urllib.parse import quote, urlencode, urlsplit, parse_qs
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 UPLOAD_URL = os.environ.get('UPLOAD_URL', '')
 PROJECT_URL = os.environ.get('PROJECT_URL', '')
@@ -27,6 +37,56 @@ NAME = os.environ.get('NAME', 'Vls')
 CHAT_ID = os.environ.get('CHAT_ID', '')
 BOT_TOKEN = os.environ.get('BOT_TOKEN', '')
 PORT = int(os.environ.get('SERVER_PORT') or os.environ.get('PORT') or 3000)
+LOW_FOOTPRINT = os.environ.get('LOW_FOOTPRINT', 'false').lower() == 'true'   # 小内存模式：不用 uvloop、brotli，限制线程和连接数
+SERVER_MODE = os.environ.get('SERVER_MODE', 'async').lower()          # async (uvloop) 或 thread
+MAX_CONNECTIONS = int(os.environ.get('MAX_CONNECTIONS', '64' if LOW_FOOTPRINT else '512'))
+KEEPALIVE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', '5'))
+REQUEST_TIMEOUT = float(os.environ.get('REQUEST_TIMEOUT', '10'))
+BIN_BASE_URL = os.environ.get('BIN_BASE_URL', '').rstrip('/')           # 覆盖二进制下载地址，例如本地测试服务器
+BIN_CACHE_DIR = os.environ.get('BIN_CACHE_DIR', os.path.join(FILE_PATH, 'bin-cache'))
+BIN_CACHE_MAX_AGE = float(os.environ.get('BIN_CACHE_MAX_AGE', '604800'))   # 超过该秒数才用 ETag 向源站复核
+DOWNLOAD_TIMEOUT = float(os.environ.get('DOWNLOAD_TIMEOUT', '30'))
+HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', '10'))
+HTTP_RETRIES = int(os.environ.get('HTTP_RETRIES', '3'))
+HTTP_BACKOFF_MAX = float(os.environ.get('HTTP_BACKOFF_MAX', '20'))
+OUTBOUND_QUEUE_SIZE = int(os.environ.get('OUTBOUND_QUEUE_SIZE', '32'))
+TELEGRAM_API = os.environ.get('TELEGRAM_API', 'https://api.telegram.org')
+META_URL = os.environ.get('META_URL', 'https://speed.cloudflare.com/meta')
+META_TIMEOUT = float(os.environ.get('META_TIMEOUT', '5'))
+META_TTL = float(os.environ.get('META_TTL', '3600'))
+ISP_FALLBACK = os.environ.get('ISP_FALLBACK', 'Unknown')
+ARGO_REPLICAS = max(1, int(os.environ.get('ARGO_REPLICAS', '1')))     # 固定隧道的 cloudflared 连接器副本数
+ARGO_METRICS_PORT = int(os.environ.get('ARGO_METRICS_PORT', '20241'))  # 第 i 个副本使用 ARGO_METRICS_PORT + i
+TUNING_PROFILE = os.environ.get('TUNING_PROFILE', 'balanced')           # low-memory / balanced / high-throughput
+METRICS_PATH = os.environ.get('METRICS_PATH', '/metrics')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')                    # 设置后才开启 METRICS_PATH，需 Authorization: Bearer <token>
+XRAY_API_PORT = int(os.environ.get('XRAY_API_PORT', '10085'))
+XRAY_METRICS_PORT = int(os.environ.get('XRAY_METRICS_PORT', '10086'))
+STATS_INTERVAL = float(os.environ.get('STATS_INTERVAL', '15'))
+CFIP_PROBE_INTERVAL = float(os.environ.get('CFIP_PROBE_INTERVAL', '300'))  # CFIP 可写多个候选，逗号分隔，如 a.com,1.2.3.4:2053
+CFIP_PROBE_TIMEOUT = float(os.environ.get('CFIP_PROBE_TIMEOUT', '3'))
+READY_TIMEOUT = float(os.environ.get('READY_TIMEOUT', '15'))
+HEALTH_INTERVAL = float(os.environ.get('HEALTH_INTERVAL', '5'))        # /healthz、/readyz 后台刷新间隔
+CHILD_RESTART_MAX_DELAY = float(os.environ.get('CHILD_RESTART_MAX_DELAY', '30'))
+ARGO_DOMAIN_TIMEOUT = float(os.environ.get('ARGO_DOMAIN_TIMEOUT', '30'))   # 每次等待临时隧道域名的秒数
+ARGO_DOMAIN_RETRIES = int(os.environ.get('ARGO_DOMAIN_RETRIES', '5'))
+ARGO_RETRY_MAX_DELAY = float(os.environ.get('ARGO_RETRY_MAX_DELAY', '30'))
+ENV_FILE = os.environ.get('ENV_FILE', '')                              # KEY=VALUE 文件，启动和热重载时读取，覆盖可重载的变量
+RELOAD_TOKEN = os.environ.get('RELOAD_TOKEN', '')                      # 设置后可用 POST RELOAD_PATH + Authorization: Bearer <token> 触发重载
+RELOAD_PATH = os.environ.get('RELOAD_PATH', '/-/reload')
+ARGO_PROTOCOL = os.environ.get('ARGO_PROTOCOL', 'http2').lower()      # http2 / quic；auto：固定隧道先试 quic，注册超时回落 http2
+ARGO_PROTOCOL_TIMEOUT = float(os.environ.get('ARGO_PROTOCOL_TIMEOUT', '10'))   # 每种传输等待隧道注册的秒数
+ARGO_PROTOCOL_TTL = float(os.environ.get('ARGO_PROTOCOL_TTL', '86400'))        # 测得的选择缓存多久，过期后重新测量
+ARGO_INGRESS = os.environ.get('ARGO_INGRESS', 'fallback').lower()      # tunnel.yml 入口：fallback 经 ARGO_PORT 回落，direct 按路径直连各 ws 入口
+DNS_SERVERS = os.environ.get('DNS_SERVERS', '8.8.8.8,1.1.1.1,localhost')   # 逗号分隔，支持 https://.../dns-query (DoH)、https+local://、tcp://、localhost
+DNS_QUERY_STRATEGY = os.environ.get('DNS_QUERY_STRATEGY', 'UseIP')    # UseIP / UseIPv4 / UseIPv6
+DNS_DISABLE_CACHE = os.environ.get('DNS_DISABLE_CACHE', 'false').lower() == 'true'
+DNS_HOSTS = os.environ.get('DNS_HOSTS', '')                            # 静态解析：domain=ip|ip,domain2=ip
+FREEDOM_DOMAIN_STRATEGY = os.environ.get('FREEDOM_DOMAIN_STRATEGY', 'UseIP')   # 直连出口：AsIs 用系统解析，UseIP/UseIPv4/UseIPv6 用上面的 DNS
+BLOCK_RULES = os.environ.get('BLOCK_RULES', 'preset:private')         # 丢弃到 block 出口的规则，逗号分隔：域名后缀、CIDR、geoip:/geosite:、preset:private / preset:ads
+BLOCK_RULES_FILE = os.environ.get('BLOCK_RULES_FILE', '')              # 同样格式，每行一条，# 开头为注释
+USERS = os.environ.get('USERS', '')                                    # 多用户：name:uuid[:sub_path]，逗号分隔；sub_path 默认为 uuid
+USERS_FILE = os.environ.get('USERS_FILE', '')                          # 或 JSON 列表 [{"name": ..., "uuid": ..., "sub_path": ...}]，热重载时重新读取
 
 def create_directory():
     print('\033c', end='')
@@ -42,6 +102,159 @@ sub_path = os.path.join(FILE_PATH, 'sub.txt')
 list_path = os.path.join(FILE_PATH, 'list.txt')
 boot_log_path = os.path.join(FILE_PATH, 'boot.log')
 config_path = os.path.join(FILE_PATH, 'config.json')
+state_path = os.path.join(FILE_PATH, 'state.json')
+access_log_path = os.path.join(FILE_PATH, 'access.log')   # 只在开启 METRICS_TOKEN 时写入，用于统计被屏蔽的连接
+
+# 所有对外请求共用一个基于 http.client 的连接池（不引入 requests，减少导入时间和内存），带超时和指数退避重试
+http_pool = {}
+http_pool_lock = threading.Lock()
+HTTP_POOL_SIZE = 4
+
+class HttpResponse:
+    def __init__(self, pool_key, conn, response):
+        self.pool_key = pool_key
+        self.conn = conn
+        self.raw = response
+        self.status_code = response.status
+        self.headers = response.headers
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.raw.read()
+            self.close()
+        return self._content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=65536):
+        while True:
+            chunk = self.raw.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f"HTTP {self.status_code}")
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.raw.isclosed() and not self.raw.will_close:
+            with http_pool_lock:
+                idle = http_pool.setdefault(self.pool_key, [])
+                if len(idle) < HTTP_POOL_SIZE:
+                    idle.append(self.conn)
+                    self.conn = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def http_open(method, url, params=None, payload=None, headers=None, timeout=None):
+    parts = urlsplit(url)
+    pool_key = (parts.scheme, parts.hostname, parts.port)
+    path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+    if params:
+        path += ('&' if '?' in path else '?') + urlencode(params)
+    request_headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'identity'}
+    request_headers.update(headers or {})
+    body = None
+    if payload is not None:
+        body = json.dumps(payload).encode('utf-8')
+        request_headers['Content-Type'] = 'application/json'
+
+    with http_pool_lock:
+        idle = http_pool.get(pool_key) or []
+        conn = idle.pop() if idle else None
+    reused = conn is not None
+    while True:
+        if conn is None:
+            connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            conn = connection_class(parts.hostname, parts.port, timeout=timeout or HTTP_TIMEOUT)
+        else:
+            conn.timeout = timeout or HTTP_TIMEOUT
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+        try:
+            conn.request(method, path, body=body, headers=request_headers)
+            return HttpResponse(pool_key, conn, conn.getresponse())
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            # 连接池里的空闲连接可能已被对端关闭，换新连接重试一次
+            if not reused:
+                raise
+            conn = None
+            reused = False
+
+def fetch_json(url, timeout=None):
+    with http_open('GET', url, timeout=timeout) as response:
+        response.raise_for_status()
+        return response.json()
+
+def http_request(method, url, **kwargs):
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            response = http_open(method, url, **kwargs)
+            response.content
+            if response.status_code < 500 and response.status_code != 429:
+                return response
+            error = f"HTTP {response.status_code}"
+        except (OSError, http.client.HTTPException) as e:
+            error = e
+        if attempt == HTTP_RETRIES:
+            raise IOError(f"{method} {url} failed after {attempt + 1} attempts: {error}")
+        time.sleep(random.uniform(0, min(HTTP_BACKOFF_MAX, 2 ** attempt)))
+
+# 上报、删除、通知等请求排队在后台依次发送，不阻塞启动。
+# 发送和重试退避（time.sleep）在独立的单线程里进行，不占用下载、配置等启动步骤共用的默认线程池
+outbound_queue = None
+outbound_worker_task = None
+outbound_executor = None
+
+def enqueue_outbound(name, func, *args):
+    try:
+        outbound_queue.put_nowait((name, func, args))
+    except asyncio.QueueFull:
+        print(f"Outbound queue is full, dropping {name}")
+
+async def outbound_worker():
+    while True:
+        name, func, args = await outbound_queue.get()
+        try:
+            await asyncio.get_running_loop().run_in_executor(outbound_executor, func, *args)
+        except Exception as e:
+            print(f"Error in {name}: {e}")
+        finally:
+            outbound_queue.task_done()
+
+def start_outbound_worker():
+    global outbound_queue, outbound_worker_task, outbound_executor
+    from concurrent.futures import ThreadPoolExecutor
+    outbound_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbound')
+    outbound_queue = asyncio.Queue(OUTBOUND_QUEUE_SIZE)
+    outbound_worker_task = asyncio.ensure_future(outbound_worker())
+
+def extract_nodes(content):
+    return [line for line in content.split('\n') if any(protocol in line for protocol in ['vless://', 'vmess://', 'trojan://', 'hysteria2://', 'tuic://'])]
+
+def post_nodes(action, nodes):
+    response = http_request('POST', f"{UPLOAD_URL}/api/{action}", payload={"nodes": nodes})
+    if response.status_code != 200:
+        raise IOError(f"{action} returned HTTP {response.status_code}")
+    if action == 'add-nodes':
+        mark_synced(added=nodes)
+    else:
+        mark_synced(removed=nodes)
+    return response
 
 def delete_nodes():
     try:
@@ -51,30 +264,31 @@ def delete_nodes():
         if not os.path.exists(sub_path):
             return
 
-        try:
-            with open(sub_path, 'r') as file:
-                file_content = file.read()
-        except:
-            return None
-
-        decoded = base64.b64decode(file_content).decode('utf-8')
-        nodes = [line for line in decoded.split('\n') if any(protocol in line for protocol in ['vless://', 'vmess://', 'trojan://', 'hysteria2://', 'tuic://'])]
+        with open(sub_path, 'r') as file:
+            file_content = file.read()
 
-        if not nodes:
-            return
-
-        try:
-            requests.post(f"{UPLOAD_URL}/api/delete-nodes", 
-                          data=json.dumps({"nodes": nodes}),
-                          headers={"Content-Type": "application/json"})
-        except:
-            return None
+        nodes = extract_nodes(base64.b64decode(file_content).decode('utf-8'))
+        if nodes:
+            enqueue_outbound('delete_nodes', post_nodes, 'delete-nodes', nodes)
     except Exception as e:
         print(f"Error in delete_nodes: {e}")
-        return None
+
+def current_links():
+    return extract_nodes(published_list)
+
+def sync_node_links(old_links, new_links):
+    # 订阅地址模式下上游自己拉取；节点模式只发送差异
+    if not UPLOAD_URL or PROJECT_URL:
+        return
+    removed = [link for link in old_links if link not in new_links]
+    added = [link for link in new_links if link not in old_links]
+    if removed:
+        enqueue_outbound('delete_nodes', post_nodes, 'delete-nodes', removed)
+    if added:
+        enqueue_outbound('add_nodes', post_nodes, 'add-nodes', added)
 
 def cleanup_old_files():
-    paths_to_delete = ['web', 'bot', 'boot.log', 'list.txt']
+    paths_to_delete = ['web', 'bot', 'boot.log', 'list.txt', 'access.log']
     for file in paths_to_delete:
         file_path = os.path.join(FILE_PATH, file)
         try:
@@ -86,50 +300,643 @@ def cleanup_old_files():
         except Exception as e:
             print(f"Error removing {file_path}: {e}")
 
+# 用户表：每个用户写进所有入口的 clients（email 用于 xray 按用户统计流量），并有自己的订阅路径
+# 没有配置 USERS/USERS_FILE 时只有一个用户，即 NAME/UUID/SUB_PATH
+User = namedtuple('User', ['name', 'uuid', 'sub_path'])
+USER_FIELD_PATTERN = re.compile(r'^[\w.@-]+$')
+users = []
+
+def load_users():
+    entries = []
+    if USERS_FILE:
+        with open(USERS_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, list):
+            raise ValueError(f"{USERS_FILE} must contain a JSON list of users")
+        entries.extend(data)
+    for item in USERS.split(','):
+        if item.strip():
+            entries.append(dict(zip(('name', 'uuid', 'sub_path'), item.strip().split(':'))))
+    if not entries:
+        return [User(NAME, UUID, SUB_PATH)]
+
+    loaded = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError(f"user entry must be an object: {entry!r}")
+        if any(not isinstance(entry.get(field, ''), str) for field in User._fields):
+            raise ValueError(f"user fields must be strings: {entry}")
+        if not entry.get('name') or not entry.get('uuid'):
+            raise ValueError(f"user entry needs a name and a uuid: {entry}")
+        user = User(entry['name'], entry['uuid'], entry.get('sub_path') or entry['uuid'])
+        if not USER_FIELD_PATTERN.match(user.name) or not USER_FIELD_PATTERN.match(user.sub_path):
+            raise ValueError(f"invalid name or sub_path for user {user.name}")
+        if any(user.name == other.name or user.sub_path == other.sub_path for other in loaded):
+            raise ValueError(f"duplicate name or sub_path for user {user.name}")
+        loaded.append(user)
+    return loaded
+
+def refresh_users():
+    global users
+    loaded = load_users()
+    changed = loaded != users
+    users = loaded
+    return changed
+
+# 订阅内容常驻内存，重新生成时整体替换，请求路径上不读磁盘
+Subscription = namedtuple('Subscription', ['body', 'content_type', 'etags', 'last_modified', 'modified_at', 'encodings'])
+current_subscriptions = {}   # /sub_path -> {格式 -> Subscription}，节点变化时整体替换
+current_nodes = None
+published_list = ''          # list.txt 的内容，包含所有用户的节点
+
+def build_subscription(content, content_type='text/plain'):
+    body = content.encode('utf-8')
+    modified_at = int(time.time())
+    encodings = {}
+    if not LOW_FOOTPRINT:
+        try:
+            import brotli
+            encodings['br'] = brotli.compress(body, quality=11)
+        except ImportError:
+            pass
+    encodings['gzip'] = gzip.compress(body, compresslevel=9, mtime=modified_at)
+    encodings = {name: data for name, data in encodings.items() if len(data) < len(body)}
+    # 每种编码是不同的表示，强 ETag 必须各不相同：None 对应未压缩的 body
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    etags = {None: f'"{digest}"'}
+    etags.update({name: f'"{digest}-{name}"' for name in encodings})
+    return Subscription(
+        body=body,
+        content_type=content_type,
+        etags=etags,
+        last_modified=formatdate(modified_at, usegmt=True),
+        modified_at=modified_at,
+        encodings=encodings,
+    )
+
+def write_file_atomic(path, content):
+    # 每个线程用自己的临时文件，并发写同一路径时不会互相 replace 掉对方的文件
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def build_subscriptions(nodes):
+    sub_txt = base64.b64encode(render_links(nodes).encode('utf-8')).decode('utf-8')
+    return {
+        'base64': build_subscription(sub_txt),
+        'clash': build_subscription(render_clash(nodes), 'text/yaml; charset=utf-8'),
+        'singbox': build_subscription(render_singbox(nodes), 'application/json'),
+    }
+
+def publish_nodes(nodes):
+    global current_subscriptions, current_nodes, published_list
+    if nodes == current_nodes:
+        return base64.b64encode(published_list.encode('utf-8')).decode('utf-8')
+
+    list_txt = render_links(nodes)
+    sub_txt = base64.b64encode(list_txt.encode('utf-8')).decode('utf-8')
+    current_subscriptions = {
+        f"/{user.sub_path}": build_subscriptions([node for node in nodes if node["sub_path"] == user.sub_path])
+        for user in users
+    }
+    current_nodes = nodes
+    published_list = list_txt
+    write_file_atomic(list_path, list_txt)
+    write_file_atomic(sub_path, sub_txt)
+    if link_inputs:
+        save_state(nodes)
+    return sub_txt
+
+SUBSCRIPTION_FORMATS = {
+    'base64': 'base64', 'v2ray': 'base64',
+    'clash': 'clash', 'mihomo': 'clash', 'meta': 'clash', 'stash': 'clash',
+    'singbox': 'singbox', 'sing-box': 'singbox',
+}
+CLASH_AGENTS = ('clash', 'mihomo', 'stash')
+SINGBOX_AGENTS = ('sing-box', 'sfa', 'sfi', 'sfm', 'sft')
+
+def choose_format(query, headers):
+    for name in ('format', 'target', 'flag'):
+        if name in query:
+            return SUBSCRIPTION_FORMATS.get(query[name][0].lower())
+    user_agent = headers.get('user-agent', '').lower()
+    if any(agent in user_agent for agent in CLASH_AGENTS):
+        return 'clash'
+    if any(agent in user_agent for agent in SINGBOX_AGENTS):
+        return 'singbox'
+    return 'base64'
+
+def is_not_modified(subscription, etag, headers):
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(if_modified_since).timestamp() >= subscription.modified_at
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def choose_encoding(subscription, headers):
+    accepted = {}
+    for item in headers.get('accept-encoding', '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for name in ('br', 'gzip'):
+        if accepted.get(name, 0) > 0 and name in subscription.encodings:
+            return name
+    return None
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+    def render(self, name):
+        lines = [f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bucket}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.sum:.6f}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+subscription_latency = Histogram((0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+# xray 的 expvar 统计由后台任务定期抓取，/metrics 只读缓存。
+# blackhole 出口不产生流量字节，被屏蔽的连接改为从访问日志里数 "[入口 >> block]"（旧版 xray 是 ->），
+# 每次读完超过 ACCESS_LOG_MAX_BYTES 就截断；xray 以追加方式写入，截断后从头继续写
+xray_stats = {}
+xray_stats_updated = 0.0
+stats_task = None
+ACCESS_LOG_MAX_BYTES = 1 << 20
+BLOCKED_PATTERN = re.compile(r'\[(\S+) (?:>>|->) block\]')
+blocked_connections = {}   # 入口 tag -> 被屏蔽的连接数
+
+def observe_request(path, duration):
+    if path.split('?', 1)[0] in current_subscriptions:
+        subscription_latency.observe(duration)
+
+def count_blocked(follower):
+    for line in follower.read_lines():
+        match = BLOCKED_PATTERN.search(line)
+        if match:
+            blocked_connections[match.group(1)] = blocked_connections.get(match.group(1), 0) + 1
+    if follower.position > ACCESS_LOG_MAX_BYTES:
+        os.truncate(access_log_path, 0)
+        follower.position = 0
+        follower.pending = b''
+
+async def scrape_xray_stats():
+    global xray_stats, xray_stats_updated
+    follower = LogFollower(access_log_path)
+    while True:
+        try:
+            status, body = await local_http_get(XRAY_METRICS_PORT, '/debug/vars')
+            if status == 200:
+                xray_stats = json.loads(body).get('stats', {})
+                xray_stats_updated = time.time()
+        except (OSError, ValueError, asyncio.TimeoutError):
+            pass
+        try:
+            await asyncio.to_thread(count_blocked, follower)
+        except OSError as e:
+            print(f"Error reading {access_log_path}: {e}")
+        await asyncio.sleep(STATS_INTERVAL)
+
+def render_metrics():
+    lines = ["# TYPE xray_traffic_bytes_total counter"]
+    for kind in ('inbound', 'outbound', 'user'):
+        for tag, traffic in sorted(xray_stats.get(kind, {}).items()):
+            for direction in ('uplink', 'downlink'):
+                lines.append(f'xray_traffic_bytes_total{{{kind}="{tag}",direction="{direction}"}} {traffic.get(direction, 0)}')
+    lines.append("# TYPE xray_blocked_connections_total counter")
+    for tag, count in sorted(blocked_connections.items()):
+        lines.append(f'xray_blocked_connections_total{{inbound="{tag}"}} {count}')
+    lines.append("# TYPE xray_stats_last_scrape_timestamp_seconds gauge")
+    lines.append(f"xray_stats_last_scrape_timestamp_seconds {xray_stats_updated:.0f}")
+
+    lines.append("# TYPE edge_handshake_seconds gauge")
+    for (host, port), latency in edge_latencies.items():
+        lines.append(f'edge_handshake_seconds{{endpoint="{host}:{port}"}} {-1 if latency is None else round(latency, 6)}')
+
+    lines.append("# TYPE tunnel_transport_info gauge")
+    lines.append(f'tunnel_transport_info{{protocol="{argo_protocol}"}} 1')
+    lines.append("# TYPE tunnel_registration_seconds gauge")
+    for protocol, timing in transport_timings.items():
+        registered = timing["registered_s"]
+        lines.append(f'tunnel_registration_seconds{{protocol="{protocol}"}} {-1 if registered is None else registered}')
+
+    lines.append("# TYPE child_up gauge")
+    children = [web_process] + bot_processes
+    for child in children:
+        lines.append(f'child_up{{name="{child.name}"}} {int(child.is_running())}')
+    lines.append("# TYPE child_restarts_total counter")
+    for child in children:
+        lines.append(f'child_restarts_total{{name="{child.name}"}} {child.restarts}')
+
+    rss, peak = read_memory_usage()
+    lines.append("# TYPE process_import_seconds gauge")
+    lines.append(f"process_import_seconds {IMPORT_SECONDS:.6f}")
+    lines.append("# TYPE process_resident_memory_bytes gauge")
+    lines.append(f"process_resident_memory_bytes {rss}")
+    lines.append("# TYPE process_resident_memory_peak_bytes gauge")
+    lines.append(f"process_resident_memory_peak_bytes {peak}")
+    lines.append("# TYPE process_threads gauge")
+    lines.append(f"process_threads {threading.active_count()}")
+
+    lines.append("# TYPE startup_phase_seconds gauge")
+    for name, (_, duration) in phase_timings.items():
+        lines.append(f'startup_phase_seconds{{phase="{name}"}} {duration:.6f}')
+
+    lines.extend(subscription_latency.render('subscription_request_duration_seconds'))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def bearer_authorized(headers, token):
+    authorization = headers.get('authorization', '').encode('latin-1', 'replace')
+    return hmac.compare_digest(authorization, f"Bearer {token}".encode('latin-1', 'replace'))
+
+def route_request(path, headers):
+    path, _, query_string = path.partition('?')
+    if path == '/':
+        return 200, [('Content-type', 'text/html')], b'Hello World'
+
+    subscriptions = current_subscriptions.get(path)
+    if subscriptions is not None:
+        subscription_format = choose_format(parse_qs(query_string) if query_string else {}, headers)
+        subscription = subscriptions.get(subscription_format)
+        if subscription is None:
+            return 404, [], b''
+
+        # 先确定要发送的编码，再用该表示自己的 ETag 做条件请求判断
+        encoding = choose_encoding(subscription, headers)
+        etag = subscription.etags[encoding]
+        response_headers = [
+            ('ETag', etag),
+            ('Last-Modified', subscription.last_modified),
+            ('Cache-Control', 'no-cache'),
+            ('Vary', 'Accept-Encoding, User-Agent'),
+        ]
+        if is_not_modified(subscription, etag, headers):
+            return 304, response_headers, b''
+
+        response_headers.append(('Content-type', subscription.content_type))
+        if encoding:
+            response_headers.append(('Content-Encoding', encoding))
+            return 200, response_headers, subscription.encodings[encoding]
+        return 200, response_headers, subscription.body
+
+    health = health_responses.get(path)
+    if health is not None:
+        return health
+
+    if METRICS_TOKEN and path == METRICS_PATH:
+        if not bearer_authorized(headers, METRICS_TOKEN):
+            return 401, [('WWW-Authenticate', 'Bearer')], b''
+        return 200, [('Content-type', 'text/plain; version=0.0.4')], render_metrics()
+
+    return 404, [], b''
+
+def route_post(path, headers):
+    path = path.partition('?')[0]
+    if RELOAD_TOKEN and path == RELOAD_PATH:
+        if not bearer_authorized(headers, RELOAD_TOKEN):
+            return 401, [('WWW-Authenticate', 'Bearer')], b''
+        main_loop.call_soon_threadsafe(schedule_reload, 'http')
+        return 202, [('Content-type', 'text/plain')], b'Reload scheduled\n'
+    return 405, [('Allow', 'GET, HEAD')], b''
+
 class RequestHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b'Hello World')
-            
-        elif self.path == f'/{SUB_PATH}':
-            try:
-                with open(sub_path, 'rb') as f:
-                    content = f.read()
-                self.send_response(200)
-                self.send_header('Content-type', 'text/plain')
-                self.end_headers()
-                self.wfile.write(content)
-            except:
-                self.send_response(404)
-                self.end_headers()
-        else:
-            self.send_response(404)
-            self.end_headers()
+        request_headers = {name.lower(): value for name, value in self.headers.items()}
+        self.respond(route_request, request_headers)
+
+    def do_POST(self):
+        request_headers = {name.lower(): value for name, value in self.headers.items()}
+        length = int(request_headers.get('content-length', '0') or 0)
+        if length:
+            self.rfile.read(min(length, 65536))
+        self.respond(route_post, request_headers)
+
+    def respond(self, route, request_headers):
+        started = time.perf_counter()
+        status, headers, body = route(self.path, request_headers)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+        observe_request(self.path, time.perf_counter() - started)
 
     def log_message(self, format, *args):
         pass
-    
+
+connection_slots = None
+waiting_connections = 0
+
+async def handle_connection(reader, writer):
+    # 连接数满时最多再排队 MAX_CONNECTIONS 个，每个最多等 REQUEST_TIMEOUT，超出的直接 503 关闭
+    global waiting_connections
+    if connection_slots.locked():
+        if waiting_connections >= MAX_CONNECTIONS:
+            await reject_connection(writer)
+            return
+        waiting_connections += 1
+        try:
+            await asyncio.wait_for(connection_slots.acquire(), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            await reject_connection(writer)
+            return
+        finally:
+            waiting_connections -= 1
+    else:
+        await connection_slots.acquire()
+    try:
+        await serve_connection(reader, writer)
+    finally:
+        connection_slots.release()
+
+async def reject_connection(writer):
+    try:
+        await write_response(writer, 503, [('Retry-After', '1')], b'', False)
+    except Exception:
+        pass
+    writer.close()
+
+async def serve_connection(reader, writer):
+    timeout = REQUEST_TIMEOUT
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                break
+            except (asyncio.LimitOverrunError, ValueError):
+                await write_response(writer, 431, [], b'', False)
+                break
+
+            lines = head.decode('latin-1').split('\r\n')
+            parts = lines[0].split()
+            if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+                await write_response(writer, 400, [], b'', False)
+                break
+            method, path, version = parts
+
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+
+            connection = headers.get('connection', '').lower()
+            if version == 'HTTP/1.1':
+                keep_alive = connection != 'close'
+            else:
+                keep_alive = connection == 'keep-alive'
+            # 连接数满时不再保持空闲连接，把位置让给排队的客户端
+            if connection_slots.locked():
+                keep_alive = False
+
+            if 'transfer-encoding' in headers:
+                await write_response(writer, 501, [], b'', False)
+                break
+            try:
+                length = int(headers.get('content-length', '0'))
+            except ValueError:
+                length = -1
+            if length < 0 or length > 65536:
+                await write_response(writer, 400, [], b'', False)
+                break
+            if length:
+                await asyncio.wait_for(reader.readexactly(length), REQUEST_TIMEOUT)
+
+            started = time.perf_counter()
+            if method in ('GET', 'HEAD'):
+                status, response_headers, body = route_request(path, headers)
+                if status == 304:
+                    body = None
+                elif method == 'HEAD':
+                    response_headers = response_headers + [('Content-Length', str(len(body)))]
+                    body = None
+            elif method == 'POST':
+                status, response_headers, body = route_post(path, headers)
+            else:
+                status, response_headers, body = 405, [('Allow', 'GET, HEAD')], b''
+
+            await write_response(writer, status, response_headers, body, keep_alive)
+            observe_request(path, time.perf_counter() - started)
+            if not keep_alive:
+                break
+            timeout = KEEPALIVE_TIMEOUT
+    except Exception:
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+async def write_response(writer, status, headers, body, keep_alive):
+    lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+    for name, value in headers:
+        lines.append(f'{name}: {value}')
+    if body is not None:
+        lines.append(f'Content-Length: {len(body)}')
+    lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    if body:
+        writer.write(body)
+    await asyncio.wait_for(writer.drain(), REQUEST_TIMEOUT)
+
+async def start_async_server():
+    global connection_slots
+    connection_slots = asyncio.Semaphore(MAX_CONNECTIONS)
+    server = await asyncio.start_server(handle_connection, '0.0.0.0', PORT, limit=16384, backlog=MAX_CONNECTIONS)
+    print(f"Server is running on port {PORT} (async, max {MAX_CONNECTIONS} connections)")
+    return server
+
 def get_system_architecture():
-    architecture = platform.machine().lower()
+    architecture = os.uname().machine.lower()
     if 'arm' in architecture or 'aarch64' in architecture:
         return 'arm'
     else:
         return 'amd'
 
-def download_file(file_name, file_url):
-    file_path = os.path.join(FILE_PATH, file_name)
+# 二进制按 sha256 存放在 BIN_CACHE_DIR，index.json 记录 架构/文件名 -> url、etag、sha256
+bin_index_path = os.path.join(BIN_CACHE_DIR, 'index.json')
+bin_index_lock = threading.Lock()
+
+def blob_path(sha256):
+    return os.path.join(BIN_CACHE_DIR, sha256)
+
+def load_bin_index():
+    try:
+        with open(bin_index_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def update_bin_index(key, entry):
+    with bin_index_lock:
+        index = load_bin_index()
+        previous = index.get(key)
+        index[key] = entry
+        write_file_atomic(bin_index_path, json.dumps(index, indent=2))
+
+    if previous and previous['sha256'] != entry['sha256']:
+        if not any(item['sha256'] == previous['sha256'] for item in index.values()):
+            try:
+                os.remove(blob_path(previous['sha256']))
+            except OSError:
+                pass
+
+def hash_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest
+
+def is_valid_blob(entry):
+    path = blob_path(entry['sha256'])
+    try:
+        if os.path.getsize(path) != entry['size']:
+            return False
+    except OSError:
+        return False
+    return hash_file(path).hexdigest() == entry['sha256']
+
+def remove_partial(part_path, part_meta_path):
+    for path in (part_path, part_meta_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def fetch_binary(key, file_url, cached=None, resume=True):
+    part_path = os.path.join(BIN_CACHE_DIR, key.replace('/', '-') + '.part')
+    part_meta_path = part_path + '.json'
+
+    headers = {}
+    offset = 0
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    elif resume and os.path.exists(part_path):
+        try:
+            with open(part_meta_path, 'r') as f:
+                part_meta = json.load(f)
+        except (OSError, ValueError):
+            part_meta = {}
+        if part_meta.get('url') == file_url and part_meta.get('validator'):
+            offset = os.path.getsize(part_path)
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = part_meta['validator']
+
+    if not offset:
+        return download_binary(key, file_url, cached, headers, part_path, part_meta_path, 0)
+    # 续传失败（416、校验不符、中途断开等）时丢掉残留的分段，从头重下一次，避免每次启动都卡在同一个坏分段上
     try:
-        response = requests.get(file_url, stream=True)
+        return download_binary(key, file_url, cached, headers, part_path, part_meta_path, offset)
+    except Exception as e:
+        print(f"Resume of {key} failed ({e}), downloading from scratch")
+        remove_partial(part_path, part_meta_path)
+        return fetch_binary(key, file_url, cached, resume=False)
+
+def download_binary(key, file_url, cached, headers, part_path, part_meta_path, offset):
+    with http_open('GET', file_url, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 304 and cached:
+            return dict(cached, checked_at=time.time()), False
         response.raise_for_status()
-        
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
+
+        digest = hashlib.sha256()
+        if offset and response.status_code == 206 and response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+            hash_file(part_path, digest)
+            mode = 'ab'
+            print(f"Resuming {key} from {offset} bytes")
+        else:
+            offset = 0
+            mode = 'wb'
+            etag = response.headers.get('ETag', '')
+            validator = etag if etag and not etag.startswith('W/') else response.headers.get('Last-Modified')
+            write_file_atomic(part_meta_path, json.dumps({"url": file_url, "validator": validator}))
+
+        expected_size = offset + int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=65536):
                 f.write(chunk)
-        
-        print(f"Download {file_name} successfully")
+                digest.update(chunk)
+            size = f.tell()
+
+        if expected_size is not None and size != expected_size:
+            raise IOError(f"incomplete download, got {size} of {expected_size} bytes")
+
+        # 只有完整且哈希已算好的文件才会以 sha256 命名，发布是原子的
+        sha256 = digest.hexdigest()
+        os.replace(part_path, blob_path(sha256))
+        remove_partial(part_path, part_meta_path)
+
+        return {"url": file_url, "etag": response.headers.get('ETag', ''), "sha256": sha256, "size": size, "checked_at": time.time()}, True
+
+def publish_binary(source_path, file_path):
+    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copyfile(source_path, tmp_path)
+    os.chmod(tmp_path, 0o775)
+    os.replace(tmp_path, file_path)
+
+def download_file(file_name, file_url, architecture):
+    file_path = os.path.join(FILE_PATH, file_name)
+    key = f"{architecture}/{file_name}"
+    try:
+        os.makedirs(BIN_CACHE_DIR, exist_ok=True)
+        cached = load_bin_index().get(key)
+        if not (cached and cached.get('url') == file_url and is_valid_blob(cached)):
+            cached = None
+
+        if cached and time.time() - cached.get('checked_at', 0) < BIN_CACHE_MAX_AGE:
+            entry = cached
+            print(f"Using cached {file_name} ({entry['sha256'][:12]})")
+        else:
+            try:
+                entry, downloaded = fetch_binary(key, file_url, cached)
+                print(f"Download {file_name} successfully" if downloaded else f"Cached {file_name} is up to date")
+            except Exception as e:
+                if not cached:
+                    raise
+                entry = cached
+                print(f"Revalidating {file_name} failed, using cached copy: {e}")
+            update_bin_index(key, entry)
+
+        publish_binary(blob_path(entry['sha256']), file_path)
         return True
     except Exception as e:
         if os.path.exists(file_path):
@@ -138,7 +945,12 @@ def download_file(file_name, file_url):
         return False
 
 def get_files_for_architecture(architecture):
-    if architecture == 'arm':
+    if BIN_BASE_URL:
+        base_files = [
+            {"fileName": "web", "fileUrl": f"{BIN_BASE_URL}/web"},
+            {"fileName": "bot", "fileUrl": f"{BIN_BASE_URL}/2go"}
+        ]
+    elif architecture == 'arm':
         base_files = [
             {"fileName": "web", "fileUrl": "https://arm64.ssss.nyc.mn/web"},
             {"fileName": "bot", "fileUrl": "https://arm64.ssss.nyc.mn/2go"}
@@ -161,6 +973,18 @@ def authorize_files(file_paths):
             except Exception as e:
                 print(f"Empowerment failed for {absolute_file_path}: {e}")
 
+# 各 ws 入口的路径和本地端口，与 build_config 里的 fallbacks 一致
+WS_INBOUNDS = (('/vless-argo', 3002), ('/vmess-argo', 3003), ('/trojan-argo', 3004))
+
+def tunnel_ingress():
+    # direct 模式下 cloudflared 按路径直接连到 ws 入口，省掉经 ARGO_PORT 回落的一跳本地 TCP
+    if ARGO_INGRESS != 'direct':
+        return ''
+    return ''.join(f"""  - hostname: {ARGO_DOMAIN}
+    path: ^{path}
+    service: http://127.0.0.1:{port}
+""" for path, port in WS_INBOUNDS)
+
 def argo_type():
     if not ARGO_AUTH or not ARGO_DOMAIN:
         print("ARGO_DOMAIN or ARGO_AUTH variable is empty, use quick tunnels")
@@ -174,10 +998,10 @@ def argo_type():
         tunnel_yml = f"""
 tunnel: {tunnel_id}
 credentials-file: {os.path.join(FILE_PATH, 'tunnel.json')}
-protocol: http2
+protocol: {argo_protocol}
 
 ingress:
-  - hostname: {ARGO_DOMAIN}
+{tunnel_ingress()}  - hostname: {ARGO_DOMAIN}
     service: http://localhost:{ARGO_PORT}
     originRequest:
       noTLSVerify: true
@@ -188,69 +1012,266 @@ ingress:
     else:
         print("Use token connect to tunnel,please set the {ARGO_PORT} in cloudflare")
 
-def exec_cmd(command):
+async def local_http_get(port, path, timeout=2.0):
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
     try:
-        process = subprocess.Popen(
-            command, 
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
+        writer.write(f"GET {path} HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n".encode('latin-1'))
+        data = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, body = data.partition(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1]), body
+
+async def probe_port(port, host='127.0.0.1', timeout=1.0):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
+
+# 直接 exec 子进程（不经过 shell），记录 pid，异常退出后按指数退避重启
+class ChildProcess:
+    def __init__(self, name, build_args, prepare=None, ports=()):
+        self.name = name
+        self.build_args = build_args
+        self.prepare = prepare
+        self.ports = list(ports)
+        self.process = None
+        self.started_at = 0.0
+        self.restarts = 0
+        self.stopping = False
+        self.restart_requested = False
+        self.spawned = asyncio.Event()
+        self.spawn_error = None
+        self.task = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def is_running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def spawn(self):
+        if self.prepare:
+            await asyncio.to_thread(self.prepare)
+        self.process = await asyncio.create_subprocess_exec(
+            *self.build_args(),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
         )
-        stdout, stderr = process.communicate()
-        return stdout + stderr
-    except Exception as e:
-        print(f"Error executing command: {e}")
-        return str(e)
+        self.started_at = time.monotonic()
+        self.spawned.set()
+        print(f"{self.name} is running (pid {self.process.pid})")
 
-async def download_files_and_run():
-    global private_key, public_key
-    
-    architecture = get_system_architecture()
-    files_to_download = get_files_for_architecture(architecture)
-    
-    if not files_to_download:
-        print("Can't find a file for the current architecture")
-        return
-    
-    download_success = True
-    for file_info in files_to_download:
-        if not download_file(file_info["fileName"], file_info["fileUrl"]):
-            download_success = False
-    
-    if not download_success:
-        print("Error downloading files")
-        return
-    
-    files_to_authorize = ['web', 'bot']
-    authorize_files(files_to_authorize)
-    
-    # 核心配置：
-    # 1. 添加了 "dns" 块 (上次的修改)
-    # 2. 在 "outbounds" 的 "freedom" 协议中添加了 "domainStrategy": "UseIP" (本次的关键修正)
+    async def start(self):
+        self.stopping = False
+        await self.spawn()
+        self.task = asyncio.ensure_future(self.supervise())
+        return await self.wait_ready()
+
+    async def wait_ready(self, timeout=READY_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        pending = list(self.ports)
+        while self.is_running():
+            pending = [port for port in pending if not await probe_port(port)]
+            if not pending:
+                return True
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(0.1)
+        print(f"{self.name} is not ready (ports not accepting: {pending or 'process exited'})")
+        return False
+
+    async def supervise(self):
+        failures = 0
+        running = True   # 上次 spawn 失败时没有进程可等，直接按退避重试
+        while not self.stopping:
+            if running:
+                code = await self.process.wait()
+                if self.stopping:
+                    return
+
+            if self.restart_requested:
+                self.restart_requested = False
+                delay = 0
+            else:
+                if running and time.monotonic() - self.started_at > 60:
+                    failures = 0
+                delay = min(CHILD_RESTART_MAX_DELAY, 2 ** failures)
+                failures += 1
+                if running:
+                    print(f"{self.name} exited with code {code}, restarting in {delay:g}s")
+                else:
+                    print(f"Retrying {self.name} in {delay:g}s")
+            await asyncio.sleep(delay)
+
+            try:
+                await self.spawn()
+                self.restarts += 1
+                running = True
+            except Exception as e:
+                print(f"Error restarting {self.name}: {e}")
+                # 把失败交给正在 restart() 里等待的调用方
+                self.spawn_error = e
+                self.spawned.set()
+                running = False
+
+    async def restart(self):
+        if self.task is None or self.task.done():
+            return await self.start()
+        self.spawned.clear()
+        self.spawn_error = None
+        if self.is_running():
+            self.restart_requested = True
+            self.process.terminate()
+        try:
+            await asyncio.wait_for(self.spawned.wait(), READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"{self.name} was not restarted within {READY_TIMEOUT:g}s")
+            return False
+        if self.spawn_error is not None:
+            return False
+        return await self.wait_ready()
+
+    async def stop(self):
+        self.stopping = True
+        if self.task is not None:
+            self.task.cancel()
+        if self.is_running():
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 5)
+            except asyncio.TimeoutError:
+                self.process.kill()
+
+# policy 对应 xray 的 policy.levels.0，sockopt 加在入口和直连出口上，early_data 是链接里的 ?ed= 值。
+# bufferSize 单位 kB，不写时 xray 在 amd64 上默认 512、arm64 上默认 4；high-throughput 明确加大到 1024
+TUNING_PROFILES = {
+    'low-memory': {
+        'policy': {'handshake': 4, 'connIdle': 120, 'uplinkOnly': 1, 'downlinkOnly': 1, 'bufferSize': 4},
+        'sockopt': {'tcpFastOpen': False, 'tcpKeepAliveIdle': 60, 'tcpKeepAliveInterval': 30},
+        'early_data': 0,
+    },
+    'balanced': {
+        'policy': {'handshake': 4, 'connIdle': 300, 'uplinkOnly': 2, 'downlinkOnly': 5},
+        'sockopt': {'tcpFastOpen': True, 'tcpKeepAliveIdle': 300, 'tcpKeepAliveInterval': 30},
+        'early_data': 2560,
+    },
+    'high-throughput': {
+        'policy': {'handshake': 8, 'connIdle': 600, 'uplinkOnly': 5, 'downlinkOnly': 10, 'bufferSize': 1024},
+        'sockopt': {'tcpFastOpen': True, 'tcpKeepAliveIdle': 300, 'tcpKeepAliveInterval': 15},
+        'early_data': 2560,
+    },
+}
+
+def get_tuning_profile():
+    return TUNING_PROFILES[TUNING_PROFILE]
+
+# 屏蔽规则编译成 routing 里两条发往 block（blackhole）出口的规则：一条按域名，一条按 IP。
+# geoip:/geosite: 需要 xray 旁边有 geoip.dat/geosite.dat，预置列表直接写成域名和 CIDR，不依赖数据文件
+BLOCK_PRESETS = {
+    'private': [
+        '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16',
+        '172.16.0.0/12', '192.168.0.0/16', '::1/128', 'fc00::/7', 'fe80::/10',
+    ],
+    'ads': [
+        'doubleclick.net', 'googlesyndication.com', 'googleadservices.com', 'google-analytics.com',
+        'googletagservices.com', 'app-measurement.com', 'adnxs.com', 'adsrvr.org', 'amazon-adsystem.com',
+        'criteo.com', 'criteo.net', 'taboola.com', 'outbrain.com', 'moatads.com', 'scorecardresearch.com',
+        'rubiconproject.com', 'pubmatic.com', 'openx.net', 'casalemedia.com', 'quantserve.com',
+        'adcolony.com', 'applovin.com', 'unityads.unity3d.com', 'ads.yahoo.com',
+    ],
+}
+DOMAIN_RULE_PREFIXES = ('domain:', 'full:', 'keyword:', 'regexp:', 'geosite:')
+
+def read_block_rules():
+    entries = [item.strip() for item in BLOCK_RULES.split(',')]
+    if BLOCK_RULES_FILE:
+        try:
+            with open(BLOCK_RULES_FILE, 'r', encoding='utf-8') as f:
+                entries.extend(line.strip() for line in f if not line.lstrip().startswith('#'))
+        except OSError as e:
+            print(f"Error reading {BLOCK_RULES_FILE}: {e}")
+    return [entry for entry in entries if entry]
+
+def compile_block_rules(entries):
+    import ipaddress
+    domains, ips = [], []
+    pending = list(entries)
+    for entry in pending:
+        if entry.startswith('preset:'):
+            preset = BLOCK_PRESETS.get(entry[7:])
+            if preset is None:
+                print(f"Unknown block preset {entry}")
+                continue
+            pending.extend(preset)
+        elif entry.startswith(DOMAIN_RULE_PREFIXES):
+            domains.append(entry)
+        elif entry.startswith('geoip:'):
+            ips.append(entry)
+        else:
+            try:
+                ips.append(str(ipaddress.ip_network(entry, strict=False)))
+            except ValueError:
+                domains.append(f"domain:{entry.lstrip('.')}")
+    # 去重并保持顺序
+    return list(dict.fromkeys(domains)), list(dict.fromkeys(ips))
+
+DNS_QUERY_STRATEGIES = ('UseIP', 'UseIPv4', 'UseIPv6')
+FREEDOM_DOMAIN_STRATEGIES = (
+    'AsIs', 'UseIP', 'UseIPv4', 'UseIPv6', 'UseIPv4v6', 'UseIPv6v4',
+    'ForceIP', 'ForceIPv4', 'ForceIPv6', 'ForceIPv4v6', 'ForceIPv6v4',
+)
+
+def choose_setting(name, value, allowed, default):
+    # 只在读入设置时调用一次（启动和热重载），xray 遇到未知取值会拒绝整个配置，这里回落到默认值
+    for choice in allowed:
+        if choice.lower() == value.lower():
+            return choice
+    print(f"Unknown {name} {value}, using {default}")
+    return default
+
+def build_dns():
+    dns = {
+        "servers": [server.strip() for server in DNS_SERVERS.split(',') if server.strip()],
+        "queryStrategy": DNS_QUERY_STRATEGY,
+        "disableCache": DNS_DISABLE_CACHE,
+    }
+    hosts = {}
+    for item in DNS_HOSTS.split(','):
+        domain, _, addresses = item.partition('=')
+        addresses = [address.strip() for address in addresses.split('|') if address.strip()]
+        if domain.strip() and addresses:
+            hosts[domain.strip()] = addresses[0] if len(addresses) == 1 else addresses
+    if hosts:
+        dns["hosts"] = hosts
+    return dns
+
+def ws_path(path):
+    early_data = get_tuning_profile()['early_data']
+    return f"{path}?ed={early_data}" if early_data else path
+
+def build_config():
+    profile = get_tuning_profile()
+    # dns 块和 freedom 的 domainStrategy 由 DNS_* / FREEDOM_DOMAIN_STRATEGY 生成，见 build_dns()
     config = {
         "log": {
-            "access": "/dev/null",
+            "access": access_log_path if METRICS_TOKEN else "/dev/null",
             "error": "/dev/null",
             "loglevel": "none"
         },
-        "dns": {
-            "servers": [
-                "8.8.8.8",
-                "1.1.1.1",
-                "localhost"
-            ]
-        },
+        "dns": build_dns(),
         "inbounds": [
             {
+                "tag": "vless-tcp",
                 "port": ARGO_PORT,
                 "protocol": "vless",
                 "settings": {
                     "clients": [
-                        {
-                            "id": UUID,
-                            "flow": "xtls-rprx-vision"
-                        }
+                        {"id": user.uuid, "email": user.name, "flow": "xtls-rprx-vision"} for user in users
                     ],
                     "decryption": "none",
                     "fallbacks": [
@@ -265,14 +1286,13 @@ async def download_files_and_run():
                 }
             },
             {
+                "tag": "vless-ws",
                 "port": 3001,
                 "listen": "127.0.0.1",
                 "protocol": "vless",
                 "settings": {
                     "clients": [
-                        {
-                            "id": UUID
-                        }
+                        {"id": user.uuid, "email": user.name} for user in users
                     ],
                     "decryption": "none"
                 },
@@ -282,15 +1302,13 @@ async def download_files_and_run():
                 }
             },
             {
+                "tag": "vless-argo",
                 "port": 3002,
                 "listen": "127.0.0.1",
                 "protocol": "vless",
                 "settings": {
                     "clients": [
-                        {
-                            "id": UUID,
-                            "level": 0
-                        }
+                        {"id": user.uuid, "email": user.name, "level": 0} for user in users
                     ],
                     "decryption": "none"
                 },
@@ -308,15 +1326,13 @@ async def download_files_and_run():
                 }
             },
             {
+                "tag": "vmess-argo",
                 "port": 3003,
                 "listen": "127.0.0.1",
                 "protocol": "vmess",
                 "settings": {
                     "clients": [
-                        {
-                            "id": UUID,
-                            "alterId": 0
-                        }
+                        {"id": user.uuid, "email": user.name, "alterId": 0} for user in users
                     ]
                 },
                 "streamSettings": {
@@ -332,14 +1348,13 @@ async def download_files_and_run():
                 }
             },
             {
+                "tag": "trojan-argo",
                 "port": 3004,
                 "listen": "127.0.0.1",
                 "protocol": "trojan",
                 "settings": {
                     "clients": [
-                        {
-                            "password": UUID
-                        }
+                        {"password": user.uuid, "email": user.name} for user in users
                     ]
                 },
                 "streamSettings": {
@@ -360,11 +1375,9 @@ async def download_files_and_run():
             {
                 "protocol": "freedom",
                 "tag": "direct",
-                # VVVV 这就是本次的关键修正 VVVV
                 "settings": {
-                    "domainStrategy": "UseIP"
+                    "domainStrategy": FREEDOM_DOMAIN_STRATEGY
                 }
-                # ^^^^ 修正结束 ^^^^
             },
             {
                 "protocol": "blackhole",
@@ -373,245 +1386,1070 @@ async def download_files_and_run():
         ]
     }
 
-    with open(os.path.join(FILE_PATH, 'config.json'), 'w', encoding='utf-8') as config_file:
-        json.dump(config, config_file, ensure_ascii=False, indent=2)
-    
-    command = f"nohup {os.path.join(FILE_PATH, 'web')} -c {os.path.join(FILE_PATH, 'config.json')} >/dev/null 2>&1 &"
+    config["policy"] = {
+        "levels": {"0": dict(profile['policy'], statsUserUplink=True, statsUserDownlink=True)},
+        "system": {
+            "statsInboundUplink": True,
+            "statsInboundDownlink": True,
+            "statsOutboundUplink": True,
+            "statsOutboundDownlink": True
+        }
+    }
+    # 统计：StatsService 走 api 入口，expvar（/debug/vars）走 metrics 入口，都只监听回环地址
+    config["stats"] = {}
+    config["api"] = {"tag": "api", "services": ["StatsService"]}
+    config["metrics"] = {"tag": "metrics"}
+    config["inbounds"].extend([
+        {"tag": "api-in", "listen": "127.0.0.1", "port": XRAY_API_PORT, "protocol": "dokodemo-door", "settings": {"address": "127.0.0.1"}},
+        {"tag": "metrics-in", "listen": "127.0.0.1", "port": XRAY_METRICS_PORT, "protocol": "dokodemo-door", "settings": {"address": "127.0.0.1"}}
+    ])
+    config["routing"] = {
+        "rules": [
+            {"type": "field", "inboundTag": ["api-in"], "outboundTag": "api"},
+            {"type": "field", "inboundTag": ["metrics-in"], "outboundTag": "metrics"}
+        ]
+    }
+    blocked_domains, blocked_ips = compile_block_rules(read_block_rules())
+    if blocked_domains:
+        config["routing"]["rules"].append({"type": "field", "domain": blocked_domains, "outboundTag": "block"})
+    if blocked_ips:
+        config["routing"]["rules"].append({"type": "field", "ip": blocked_ips, "outboundTag": "block"})
+    config["inbounds"][0]["streamSettings"]["sockopt"] = dict(profile['sockopt'])
+    config["outbounds"][0]["streamSettings"] = {"sockopt": dict(profile['sockopt'])}
+    return config
+
+applied_config = None   # 最近一次写入的 config.json 内容，热重载时用来判断 xray 是否需要重启
+
+def write_config():
+    global applied_config
+    content = json.dumps(build_config(), ensure_ascii=False, indent=2)
+    write_file_atomic(config_path, content)
+    applied_config = content
+
+def restore_binary(file_name):
+    # 90 秒后二进制会被清理，重启前从缓存恢复
+    file_path = os.path.join(FILE_PATH, file_name)
+    if os.path.exists(file_path):
+        return
+    entry = load_bin_index().get(f"{get_system_architecture()}/{file_name}")
+    if entry:
+        publish_binary(blob_path(entry['sha256']), file_path)
+
+def prepare_web():
+    restore_binary('web')
+    if not os.path.exists(config_path):
+        write_config()
+
+def prepare_bot():
+    restore_binary('bot')
+    if not is_named_tunnel() and os.path.exists(boot_log_path):
+        os.remove(boot_log_path)
+
+def is_named_tunnel():
+    return bool(re.match(r'^[A-Z0-9a-z=]{120,250}$', ARGO_AUTH)) or "TunnelSecret" in ARGO_AUTH
+
+def web_args():
+    return [web_path, '-c', config_path]
+
+def bot_args(metrics_port, protocol=None):
+    # protocol 只在测量另一种传输时传入；命令行参数优先于 tunnel.yml 里的 protocol
+    base_args = ['tunnel', '--edge-ip-version', 'auto', '--metrics', f'127.0.0.1:{metrics_port}']
+    if re.match(r'^[A-Z0-9a-z=]{120,250}$', ARGO_AUTH):
+        args = ['--no-autoupdate', '--protocol', protocol or argo_protocol, 'run', '--token', ARGO_AUTH]
+    elif "TunnelSecret" in ARGO_AUTH:
+        args = (['--protocol', protocol] if protocol else []) + ['--config', os.path.join(FILE_PATH, 'tunnel.yml'), 'run']
+    else:
+        args = ['--no-autoupdate', '--protocol', protocol or argo_protocol, '--logfile', boot_log_path, '--loglevel', 'info', '--url', f'http://localhost:{ARGO_PORT}']
+    return [bot_path] + base_args + args
+
+def create_bot_processes():
+    # 临时隧道每个进程都会拿到不同的域名，只有固定隧道才能多副本
+    replicas = ARGO_REPLICAS if is_named_tunnel() else 1
+    processes = []
+    for index in range(replicas):
+        metrics_port = ARGO_METRICS_PORT + index
+        name = 'bot' if replicas == 1 else f'bot-{index + 1}'
+        process = ChildProcess(name, lambda port=metrics_port: bot_args(port), prepare=prepare_bot, ports=[metrics_port])
+        process.metrics_port = metrics_port
+        processes.append(process)
+    return processes
+
+web_process = ChildProcess('web', web_args, prepare=prepare_web, ports=[ARGO_PORT, 3001, 3002, 3003, 3004])
+bot_processes = create_bot_processes()
+bot_process = bot_processes[0]
+
+async def ready_connections(metrics_port):
+    try:
+        status, body = await local_http_get(metrics_port, '/ready')
+        return json.loads(body).get('readyConnections', 0) if status == 200 else 0
+    except (OSError, ValueError, asyncio.TimeoutError):
+        return 0
+
+async def tunnel_health():
+    replicas = []
+    for process in bot_processes:
+        connections = await ready_connections(process.metrics_port) if process.is_running() else 0
+        replicas.append({
+            "name": process.name,
+            "pid": process.pid,
+            "running": process.is_running(),
+            "restarts": process.restarts,
+            "ready_connections": connections,
+        })
+    return {
+        "replicas": replicas,
+        "running": sum(1 for replica in replicas if replica["running"]),
+        "registered": sum(1 for replica in replicas if replica["ready_connections"] > 0),
+        "connections": sum(replica["ready_connections"] for replica in replicas),
+    }
+
+# cloudflared 传输选择：auto 模式下固定隧道按上次的选择（没有则 quic）启动，不等注册就继续启动流程；
+# 后台确认注册，quic 在 ARGO_PROTOCOL_TIMEOUT 内没注册（UDP 不通）就换 http2。没有缓存的选择且 quic 可用时，
+# 再临时多起一个 http2 连接器测一次注册耗时，更快的一种写进 transport.json，下次启动使用。
+# 临时隧道每次重启都会换域名，auto 不生效，始终用 http2
+ARGO_PROTOCOLS = ('http2', 'quic')
+argo_protocol = ARGO_PROTOCOL if ARGO_PROTOCOL in ARGO_PROTOCOLS else 'http2'
+transport_timings = {}   # 传输 -> {"ready_s": ..., "registered_s": ...}
+transport_path = os.path.join(FILE_PATH, 'transport.json')
+transport_task = None
+transport_probe = None   # 正在测量另一种传输的临时连接器，退出时一并停掉
+
+async def wait_for_registration(timeout):
+    # 有副本注册上就说明这种传输可用，个别副本崩溃或慢不代表传输被阻断
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        health = await tunnel_health()
+        if health["registered"] > 0:
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+async def measure_registration(timing, started):
+    if await wait_for_registration(ARGO_PROTOCOL_TIMEOUT):
+        timing["registered_s"] = round(time.monotonic() - started, 3)
+        return True
+    return False
+
+async def launch_tunnel(protocol):
+    # 注册耗时在后台测量，不拖慢后续启动步骤
+    global argo_protocol
+    argo_protocol = protocol
+    if "TunnelSecret" in ARGO_AUTH:
+        await asyncio.to_thread(argo_type)
+    started = time.monotonic()
+    results = await asyncio.gather(*(process.restart() for process in bot_processes), return_exceptions=True)
+    timing = {"ready_s": round(time.monotonic() - started, 3), "registered_s": None}
+    transport_timings[protocol] = timing
+    registration = asyncio.ensure_future(measure_registration(timing, started))
+    return results, registration
+
+async def measure_transport(protocol):
+    # 同一个固定隧道可以有多个连接器，临时连接器用下一个空闲的 metrics 端口，不影响正在服务的副本
+    global transport_probe
+    metrics_port = ARGO_METRICS_PORT + len(bot_processes)
+    probe = transport_probe = ChildProcess(f'bot-{protocol}', lambda: bot_args(metrics_port, protocol), prepare=prepare_bot, ports=[metrics_port])
+    started = time.monotonic()
+    try:
+        await probe.start()
+        while time.monotonic() - started < ARGO_PROTOCOL_TIMEOUT:
+            if probe.is_running() and await ready_connections(metrics_port) > 0:
+                return round(time.monotonic() - started, 3)
+            await asyncio.sleep(0.1)
+        return None
+    finally:
+        transport_probe = None
+        await probe.stop()
+
+def load_transport():
+    try:
+        with open(transport_path, 'r') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if saved.get('protocol') not in ARGO_PROTOCOLS or time.time() - saved.get('measured_at', 0) > ARGO_PROTOCOL_TTL:
+        return None
+    return saved
+
+def save_transport(protocol):
+    write_file_atomic(transport_path, json.dumps({"protocol": protocol, "timings": transport_timings, "measured_at": int(time.time())}))
+
+def initial_transport():
+    if ARGO_PROTOCOL in ARGO_PROTOCOLS:
+        return ARGO_PROTOCOL
+    if ARGO_PROTOCOL != 'auto':
+        print(f"Unknown ARGO_PROTOCOL {ARGO_PROTOCOL}, using http2")
+        return 'http2'
+    if not is_named_tunnel():
+        print("ARGO_PROTOCOL=auto is not used for quick tunnels, using http2")
+        return 'http2'
+    saved = load_transport()
+    if saved:
+        transport_timings.update(saved['timings'])
+        return saved['protocol']
+    return 'quic'
+
+async def confirm_transport(protocol, registration, compare=False):
+    if not await registration and protocol == 'quic':
+        print(f"Tunnel did not register over quic within {ARGO_PROTOCOL_TIMEOUT:g}s, falling back to http2")
+        protocol = 'http2'
+        _, registration = await launch_tunnel(protocol)
+        await registration
+    registered = transport_timings[protocol]["registered_s"]
+    if registered is None:
+        print(f"Tunnel did not register over {protocol} within {ARGO_PROTOCOL_TIMEOUT:g}s")
+        return
+    print(f"Tunnel transport: {protocol} (registered in {registered}s)")
+    if compare and protocol == 'quic':
+        alternative = await measure_transport('http2')
+        transport_timings['http2'] = {"ready_s": None, "registered_s": alternative}
+        if alternative is not None and alternative < registered:
+            print(f"http2 registered faster ({alternative}s), using it from the next start")
+            protocol = 'http2'
+    await asyncio.to_thread(save_transport, protocol)
+
+# /healthz 看子进程是否存活，/readyz 还要求入口端口可连、隧道已注册、订阅已生成。
+# 后台任务定期探测并把响应整体替换，请求路径上只查字典
+HEALTH_STARTING = (503, [('Content-type', 'application/json'), ('Cache-Control', 'no-store')], b'{"status": "starting"}')
+health_responses = {'/healthz': HEALTH_STARTING, '/readyz': HEALTH_STARTING}
+health_task = None
+
+async def check_health():
+    children = [web_process] + bot_processes
+    reachable = await asyncio.gather(*(probe_port(port) for port in web_process.ports))
+    tunnel = await tunnel_health()
+    live = all(child.is_running() for child in children)
+    inbounds_ready = all(reachable)
+    ready = live and inbounds_ready and tunnel["registered"] > 0 and bool(current_subscriptions)
+    if ready:
+        status = "ready"
+    elif live:
+        status = "live"
+    else:
+        status = "starting" if any(child.process is None for child in children) else "down"
+    return {
+        "status": status,
+        "live": live,
+        "ready": ready,
+        "checked_at": int(time.time()),
+        "children": {child.name: {"running": child.is_running(), "restarts": child.restarts} for child in children},
+        "inbounds": dict(zip(map(str, web_process.ports), reachable)),
+        "tunnel": {"protocol": argo_protocol, "running": tunnel["running"], "registered": tunnel["registered"], "connections": tunnel["connections"]},
+        "subscription": bool(current_subscriptions),
+    }
+
+async def health_checker():
+    global health_responses
+    while True:
+        try:
+            report = await check_health()
+            headers = [('Content-type', 'application/json'), ('Cache-Control', 'no-store')]
+            body = json.dumps(report).encode('utf-8')
+            health_responses = {
+                '/healthz': (200 if report["live"] else 503, headers, body),
+                '/readyz': (200 if report["ready"] else 503, headers, body),
+            }
+        except Exception as e:
+            print(f"Error checking health: {e}")
+        await asyncio.sleep(HEALTH_INTERVAL)
+
+async def start_web():
+    authorize_files(['web'])
     try:
-        exec_cmd(command)
-        print('web is running')
-        time.sleep(1)
+        await web_process.start()
     except Exception as e:
         print(f"web running error: {e}")
-    
-    if os.path.exists(os.path.join(FILE_PATH, 'bot')):
-        if re.match(r'^[A-Z0-9a-z=]{120,250}$', ARGO_AUTH):
-            args = f"tunnel --edge-ip-version auto --no-autoupdate --protocol http2 run --token {ARGO_AUTH}"
-        elif "TunnelSecret" in ARGO_AUTH:
-            args = f"tunnel --edge-ip-version auto --config {os.path.join(FILE_PATH, 'tunnel.yml')} run"
-        else:
-            args = f"tunnel --edge-ip-version auto --no-autoupdate --protocol http2 --logfile {os.path.join(FILE_PATH, 'boot.log')} --loglevel info --url http://localhost:{ARGO_PORT}"
-        
+        return False
+
+async def start_bot():
+    global transport_task
+    authorize_files(['bot'])
+    if not os.path.exists(bot_path):
+        return False
+    protocol = initial_transport()
+    compare = ARGO_PROTOCOL == 'auto' and is_named_tunnel() and not transport_timings
+    results, registration = await launch_tunnel(protocol)
+    if ARGO_PROTOCOL == 'auto' and is_named_tunnel():
+        transport_task = asyncio.ensure_future(confirm_transport(protocol, registration, compare))
+    for process, result in zip(bot_processes, results):
+        if isinstance(result, Exception):
+            print(f"Error starting {process.name}: {result}")
+    if all(isinstance(result, Exception) for result in results):
+        return False
+
+ARGO_DOMAIN_PATTERN = re.compile(r'https?://([^ ]*trycloudflare\.com)/?')
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+def open_inotify(directory):
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_MODIFY | IN_CREATE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+async def wait_for_change(inotify_fd, timeout):
+    if inotify_fd is None:
+        await asyncio.sleep(min(timeout, 0.2))
+        return
+
+    loop = asyncio.get_running_loop()
+    changed = loop.create_future()
+    loop.add_reader(inotify_fd, lambda: changed.done() or changed.set_result(None))
+    try:
+        await asyncio.wait_for(changed, min(timeout, 1.0))
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(inotify_fd)
+    try:
+        while os.read(inotify_fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+class LogFollower:
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.position = 0
+        self.pending = b''
+
+    def read_lines(self):
         try:
-            exec_cmd(f"nohup {os.path.join(FILE_PATH, 'bot')} {args} >/dev/null 2>&1 &")
-            print('bot is running')
-            time.sleep(2)
-        except Exception as e:
-            print(f"Error executing command: {e}")
-    
-    time.sleep(5)
-    
-    await extract_domains()
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        # 文件被删除重建或截断后从头读
+        if stat.st_ino != self.inode or stat.st_size < self.position:
+            self.inode = stat.st_ino
+            self.position = 0
+            self.pending = b''
+        if stat.st_size == self.position:
+            return []
 
-async def extract_domains():
-    argo_domain = None
+        with open(self.path, 'rb') as f:
+            f.seek(self.position)
+            data = f.read()
+            self.position = f.tell()
 
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        return [line.decode('utf-8', 'replace') for line in lines]
+
+async def wait_for_log_match(path, pattern, timeout):
+    follower = LogFollower(path)
+    inotify_fd = open_inotify(os.path.dirname(path) or '.')
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            for line in follower.read_lines():
+                match = pattern.search(line)
+                if match:
+                    return match.group(1)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            await wait_for_change(inotify_fd, remaining)
+    finally:
+        if inotify_fd is not None:
+            os.close(inotify_fd)
+
+async def extract_domains():
     if ARGO_AUTH and ARGO_DOMAIN:
-        argo_domain = ARGO_DOMAIN
-        print(f'ARGO_DOMAIN: {argo_domain}')
-        await generate_links(argo_domain)
-    else:
+        print(f'ARGO_DOMAIN: {ARGO_DOMAIN}')
+        return ARGO_DOMAIN
+
+    for attempt in range(ARGO_DOMAIN_RETRIES + 1):
+        argo_domain = await wait_for_log_match(boot_log_path, ARGO_DOMAIN_PATTERN, ARGO_DOMAIN_TIMEOUT)
+        if argo_domain:
+            print(f'ArgoDomain: {argo_domain}')
+            return argo_domain
+
+        if attempt == ARGO_DOMAIN_RETRIES:
+            break
+        delay = min(ARGO_RETRY_MAX_DELAY, 2 ** attempt)
+        print(f'ArgoDomain not found, re-running bot to obtain ArgoDomain in {delay:g}s ({attempt + 1}/{ARGO_DOMAIN_RETRIES})')
+        await asyncio.sleep(delay)
         try:
-            with open(boot_log_path, 'r') as f:
-                file_content = f.read()
-            
-            lines = file_content.split('\n')
-            argo_domains = []
-            
-            for line in lines:
-                domain_match = re.search(r'https?://([^ ]*trycloudflare\.com)/?', line)
-                if domain_match:
-                    domain = domain_match.group(1)
-                    argo_domains.append(domain)
-            
-            if argo_domains:
-                argo_domain = argo_domains[0]
-                print(f'ArgoDomain: {argo_domain}')
-                await generate_links(argo_domain)
-            else:
-                print('ArgoDomain not found, re-running bot to obtain ArgoDomain')
-                if os.path.exists(boot_log_path):
-                    os.remove(boot_log_path)
-                
-                try:
-                    exec_cmd('pkill -f "[b]ot" > /dev/null 2>&1')
-                except:
-                    pass
-                
-                time.sleep(1)
-                args = f'tunnel --edge-ip-version auto --no-autoupdate --protocol http2 --logfile {FILE_PATH}/boot.log --loglevel info --url http://localhost:{ARGO_PORT}'
-                exec_cmd(f'nohup {os.path.join(FILE_PATH, "bot")} {args} >/dev/null 2>&1 &')
-                print('bot is running.')
-                time.sleep(6)
-                await extract_domains()
+            await bot_process.restart()
         except Exception as e:
-            print(f'Error reading boot.log: {e}')
+            print(f'Error restarting bot: {e}')
+
+    print(f'ArgoDomain not found after {ARGO_DOMAIN_RETRIES} retries')
+    return None
+
+# 临时隧道在 cloudflared 重启后会换域名：持续跟踪 boot.log，域名变化时重新生成节点，只把差异发给上游
+domain_watch_task = None
+
+async def watch_argo_domain(argo_domain):
+    global link_inputs
+    follower = LogFollower(boot_log_path)
+    inotify_fd = open_inotify(FILE_PATH)
+    try:
+        while True:
+            for line in follower.read_lines():
+                match = ARGO_DOMAIN_PATTERN.search(line)
+                if not match or match.group(1) == argo_domain:
+                    continue
+                argo_domain = match.group(1)
+                print(f'ArgoDomain changed: {argo_domain}')
+                link_inputs = (argo_domain, link_inputs[1])
+                try:
+                    await republish_nodes()
+                except Exception as e:
+                    print(f'Error republishing nodes: {e}')
+                    continue
+                enqueue_outbound('send_telegram', send_telegram)
+            await wait_for_change(inotify_fd, 60)
+    finally:
+        if inotify_fd is not None:
+            os.close(inotify_fd)
+
+def subscription_urls():
+    return [f"{PROJECT_URL}/{user.sub_path}" for user in users]
 
 def upload_nodes():
     if UPLOAD_URL and PROJECT_URL:
-        subscription_url = f"{PROJECT_URL}/{SUB_PATH}"
-        json_data = {
-            "subscription": [subscription_url]
-        }
-        
-        try:
-            response = requests.post(
-                f"{UPLOAD_URL}/api/add-subscriptions",
-                json=json_data,
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                print('Subscription uploaded successfully')
-        except Exception as e:
-            pass
+        urls = subscription_urls()
+        response = http_request('POST', f"{UPLOAD_URL}/api/add-subscriptions", payload={"subscription": urls})
+        if response.status_code != 200:
+            raise IOError(f"add-subscriptions returned HTTP {response.status_code}")
+        mark_synced(replace=urls)
+        print('Subscription uploaded successfully')
     
     elif UPLOAD_URL:
         if not os.path.exists(list_path):
             return
         
         with open(list_path, 'r') as f:
-            content = f.read()
-        
-        nodes = [line for line in content.split('\n') if any(protocol in line for protocol in ['vless://', 'vmess://', 'trojan://', 'hysteria2://', 'tuic://'])]
+            nodes = extract_nodes(f.read())
         
         if not nodes:
             return
         
-        json_data = json.dumps({"nodes": nodes})
-        
-        try:
-            response = requests.post(
-                f"{UPLOAD_URL}/api/add-nodes",
-                data=json_data,
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                print('Nodes uploaded successfully')
-        except:
-            return None
-    else:
-        return
+        post_nodes('add-nodes', nodes)
+        print('Nodes uploaded successfully')
     
 def send_telegram():
     if not BOT_TOKEN or not CHAT_ID:
         return
     
+    with open(sub_path, 'r') as f:
+        message = f.read()
+    
+    url = f"{TELEGRAM_API}/bot{BOT_TOKEN}/sendMessage"
+    
+    escaped_name = re.sub(r'([_*\[\]()~>#+=|{}.!\-])', r'\\\1', NAME)
+    
+    params = {
+        "chat_id": CHAT_ID,
+        "text": f"**{escaped_name}节点推送通知**\n{message}",
+        "parse_mode": "MarkdownV2"
+    }
+    
+    response = http_request('POST', url, params=params)
+    if response.status_code != 200:
+        raise IOError(f"Telegram returned HTTP {response.status_code}")
+    print('Telegram message sent successfully')
+
+isp_cache = None  # (ISP, 过期时间)
+
+async def get_isp():
+    global isp_cache
+    if isp_cache and isp_cache[1] > time.monotonic():
+        return isp_cache[0]
+
     try:
-        with open(sub_path, 'r') as f:
-            message = f.read()
-        
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        
-        escaped_name = re.sub(r'([_*\[\]()~>#+=|{}.!\-])', r'\\\1', NAME)
-        
-        params = {
-            "chat_id": CHAT_ID,
-            "text": f"**{escaped_name}节点推送通知**\n{message}",
-            "parse_mode": "MarkdownV2"
-        }
-        
-        requests.post(url, params=params)
-        print('Telegram message sent successfully')
+        meta = await asyncio.to_thread(fetch_json, META_URL, META_TIMEOUT)
+        parts = [str(meta[field]) for field in ('country', 'asOrganization') if meta.get(field)]
+        if not parts:
+            raise ValueError("no country or asOrganization in response")
+        ISP = '-'.join(parts).replace(' ', '_').strip()
+        isp_cache = (ISP, time.monotonic() + META_TTL)
+        return ISP
     except Exception as e:
-        print(f'Failed to send Telegram message: {e}')
+        ISP = isp_cache[0] if isp_cache else ISP_FALLBACK
+        print(f"Error fetching ISP metadata, using {ISP}: {e}")
+        return ISP
 
-async def generate_links(argo_domain):
-    meta_info = subprocess.run(['curl', '-s', 'https://speed.cloudflare.com/meta'], capture_output=True, text=True)
-    meta_info = meta_info.stdout.split('"')
-    ISP = f"{meta_info[25]}-{meta_info[17]}".replace(' ', '_').strip()
+def parse_endpoints(value, default_port):
+    endpoints = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith('['):
+            host, _, rest = item[1:].partition(']')
+            port = rest.lstrip(':')
+        elif item.count(':') == 1:
+            host, port = item.split(':')
+        else:
+            host, port = item, ''
+        endpoints.append((host, int(port) if port else default_port))
+    return endpoints
 
-    time.sleep(2)
-    VMESS = {"v": "2", "ps": f"{NAME}-{ISP}", "add": CFIP, "port": CFPORT, "id": UUID, "aid": "0", "scy": "none", "net": "ws", "type": "none", "host": argo_domain, "path": "/vmess-argo?ed=2560", "tls": "tls", "sni": argo_domain, "alpn": "", "fp": "chrome"}
- 
-    list_txt = f"""
-vless://{UUID}@{CFIP}:{CFPORT}?encryption=none&security=tls&sni={argo_domain}&fp=chrome&type=ws&host={argo_domain}&path=%2Fvless-argo%3Fed%3D2560#{NAME}-{ISP}
-  
-vmess://{ base64.b64encode(json.dumps(VMESS).encode('utf-8')).decode('utf-8')}
+CFIP_CANDIDATES = parse_endpoints(CFIP, CFPORT) or [(CFIP, CFPORT)]
+ranked_endpoints = list(CFIP_CANDIDATES)
+edge_latencies = {}
+link_inputs = None   # 最近一次生成链接用的 (argo_domain, ISP)
+edge_probe_task = None
 
-trojan://{UUID}@{CFIP}:{CFPORT}?security=tls&sni={argo_domain}&fp=chrome&type=ws&host={argo_domain}&path=%2Ftrojan-argo%3Fed%3D2560#{NAME}-{ISP}
-    """
-    
-    with open(os.path.join(FILE_PATH, 'list.txt'), 'w', encoding='utf-8') as list_file:
-        list_file.write(list_txt)
+async def probe_edge(host, port, sni, context):
+    started = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context, server_hostname=sni), CFIP_PROBE_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    latency = time.perf_counter() - started
+    writer.close()
+    return latency
 
-    sub_txt = base64.b64encode(list_txt.encode('utf-8')).decode('utf-8')
-    with open(os.path.join(FILE_PATH, 'sub.txt'), 'w', encoding='utf-8') as sub_file:
-        sub_file.write(sub_txt)
+async def rank_endpoints(sni):
+    import ssl
+    # 只测握手耗时，不校验证书
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    candidates = list(CFIP_CANDIDATES)
+    results = await asyncio.gather(*(probe_edge(host, port, sni, context) for host, port in candidates))
+    # 探测期间热重载改了 CFIP 时丢弃这轮结果
+    if candidates != CFIP_CANDIDATES:
+        return None
+    edge_latencies.update(zip(candidates, results))
+    reachable = sorted((latency, endpoint) for endpoint, latency in zip(candidates, results) if latency is not None)
+    return [endpoint for _, endpoint in reachable] or candidates
+
+async def edge_prober():
+    global ranked_endpoints
+    while True:
+        try:
+            if link_inputs:
+                ranking = await rank_endpoints(link_inputs[0])
+                if ranking is not None and ranking != ranked_endpoints:
+                    ranked_endpoints = ranking
+                    await republish_nodes()
+                    print("Edge ranking: " + ', '.join(
+                        f"{host}:{port} {edge_latencies[(host, port)] * 1000:.0f}ms" if edge_latencies.get((host, port)) is not None else f"{host}:{port} down"
+                        for host, port in ranking))
+        except Exception as e:
+            print(f"Error ranking edge endpoints: {e}")
+        await asyncio.sleep(CFIP_PROBE_INTERVAL)
+
+# 节点模型：每种格式都从这里渲染，多个 CFIP 时按握手延迟从快到慢排列
+def build_nodes(argo_domain, ISP):
+    nodes = []
+    for user in users:
+        for server, port in ranked_endpoints:
+            name = f"{user.name}-{ISP}" if len(CFIP_CANDIDATES) == 1 else f"{user.name}-{ISP}-{server}"
+            nodes.extend(
+                {"protocol": protocol, "name": name, "server": server, "port": port, "uuid": user.uuid, "user": user.name, "sub_path": user.sub_path, "host": argo_domain, "path": path}
+                for protocol, path in (('vless', '/vless-argo'), ('vmess', '/vmess-argo'), ('trojan', '/trojan-argo'))
+            )
+    return nodes
+
+def format_address(server, port):
+    return f"[{server}]:{port}" if ':' in server else f"{server}:{port}"
+
+def render_link(node):
+    host, path = node["host"], ws_path(node["path"])
+    if node["protocol"] == 'vmess':
+        VMESS = {"v": "2", "ps": node["name"], "add": node["server"], "port": node["port"], "id": node["uuid"], "aid": "0", "scy": "none", "net": "ws", "type": "none", "host": host, "path": path, "tls": "tls", "sni": host, "alpn": "", "fp": "chrome"}
+        return f"vmess://{base64.b64encode(json.dumps(VMESS).encode('utf-8')).decode('utf-8')}"
+    if node["protocol"] == 'vless':
+        return f"vless://{node['uuid']}@{format_address(node['server'], node['port'])}?encryption=none&security=tls&sni={host}&fp=chrome&type=ws&host={host}&path={quote(path, safe='')}#{node['name']}"
+    return f"trojan://{node['uuid']}@{format_address(node['server'], node['port'])}?security=tls&sni={host}&fp=chrome&type=ws&host={host}&path={quote(path, safe='')}#{node['name']}"
+
+def render_links(nodes):
+    return '\n'.join(render_link(node) for node in nodes) + '\n'
+
+def unique_names(nodes):
+    # Clash 和 sing-box 要求节点名唯一，重名时追加协议
+    counts = {}
+    for node in nodes:
+        counts[node["name"]] = counts.get(node["name"], 0) + 1
+    return [node["name"] if counts[node["name"]] == 1 else f"{node['name']}-{node['protocol']}" for node in nodes]
+
+def render_clash(nodes):
+    early_data = get_tuning_profile()['early_data']
+    names = unique_names(nodes)
+    lines = ["proxies:"]
+    for node, name in zip(nodes, names):
+        lines += [
+            f"  - name: {json.dumps(name)}",
+            f"    type: {node['protocol']}",
+            f"    server: {json.dumps(node['server'])}",
+            f"    port: {node['port']}",
+        ]
+        if node["protocol"] == 'trojan':
+            lines += [f"    password: {json.dumps(node['uuid'])}", f"    sni: {json.dumps(node['host'])}"]
+        else:
+            lines += [f"    uuid: {json.dumps(node['uuid'])}", "    tls: true", f"    servername: {json.dumps(node['host'])}"]
+        if node["protocol"] == 'vmess':
+            lines += ["    alterId: 0", "    cipher: none"]
+        lines += [
+            "    udp: true",
+            "    client-fingerprint: chrome",
+            "    network: ws",
+            "    ws-opts:",
+            f"      path: {json.dumps(node['path'])}",
+            "      headers:",
+            f"        Host: {json.dumps(node['host'])}",
+        ]
+        if early_data:
+            lines += [f"      max-early-data: {early_data}", "      early-data-header-name: Sec-WebSocket-Protocol"]
+    lines += [
+        "proxy-groups:",
+        f"  - name: {json.dumps(NAME)}",
+        "    type: select",
+        "    proxies:",
+    ] + [f"      - {json.dumps(name)}" for name in names] + [
+        "rules:",
+        f"  - {json.dumps(f'MATCH,{NAME}')}",
+    ]
+    return '\n'.join(lines) + '\n'
+
+def render_singbox(nodes):
+    early_data = get_tuning_profile()['early_data']
+    names = unique_names(nodes)
+    outbounds = [{"type": "selector", "tag": "proxy", "outbounds": names}]
+    for node, name in zip(nodes, names):
+        transport = {"type": "ws", "path": node["path"], "headers": {"Host": node["host"]}}
+        if early_data:
+            transport.update({"max_early_data": early_data, "early_data_header_name": "Sec-WebSocket-Protocol"})
+        outbound = {
+            "type": node["protocol"],
+            "tag": name,
+            "server": node["server"],
+            "server_port": node["port"],
+            "tls": {"enabled": True, "server_name": node["host"], "utls": {"enabled": True, "fingerprint": "chrome"}},
+            "transport": transport,
+        }
+        if node["protocol"] == 'trojan':
+            outbound["password"] = node["uuid"]
+        else:
+            outbound["uuid"] = node["uuid"]
+        if node["protocol"] == 'vmess':
+            outbound.update({"security": "none", "alter_id": 0})
+        outbounds.append(outbound)
+    outbounds.append({"type": "direct", "tag": "direct"})
+    return json.dumps({"outbounds": outbounds, "route": {"final": "proxy"}}, ensure_ascii=False, indent=2)
+
+def generate_links(argo_domain, ISP):
+    global link_inputs
+    link_inputs = (argo_domain, ISP)
+    sub_txt = publish_nodes(build_nodes(argo_domain, ISP))
         
     print(sub_txt)
     
     print(f"{FILE_PATH}/sub.txt saved successfully")
-    
-    upload_nodes()
   
     return sub_txt   
+
+republish_lock = None   # 域名监视、节点测速和热重载都会重新发布，串行执行保证 old/new 链接成对
+
+async def republish_nodes():
+    async with republish_lock:
+        old_links = current_links()
+        await asyncio.to_thread(publish_nodes, build_nodes(*link_inputs))
+        sync_node_links(old_links, current_links())
  
 def add_visit_task():
     if not AUTO_ACCESS or not PROJECT_URL:
         print("Skipping adding automatic access task")
         return
     
+    http_request('POST', 'https://keep.gvrander.eu.org/add-url', payload={"url": PROJECT_URL})
+    print('automatic access task added successfully')
+
+# 状态快照：上次发布的节点、ISP 和输入摘要。输入不变时重启直接用快照提供订阅，
+# synced 只记录上游确认收到（HTTP 200）的节点链接，订阅地址模式下是订阅地址，重启时只补发缺少的部分
+STATE_VERSION = 3
+state_lock = threading.Lock()   # publish_nodes（默认线程池）和上报线程都会写快照
+saved_state = None
+synced_links = []
+
+def state_inputs():
+    # 影响节点和上游的所有输入；ARGO_AUTH 只参与摘要，不写入快照
+    inputs = {
+        "config": build_config(),
+        "endpoints": CFIP_CANDIDATES,
+        "users": users,
+        "tunnel": [ARGO_DOMAIN, ARGO_AUTH, ARGO_INGRESS],
+        "upload": [UPLOAD_URL, PROJECT_URL],
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_state():
     try:
-        response = requests.post(
-            'https://keep.gvrander.eu.org/add-url',
-            json={"url": PROJECT_URL},
-            headers={"Content-Type": "application/json"}
-        )
-        print('automatic access task added successfully')
-    except Exception as e:
-        print(f'Failed to add URL: {e}')
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('version') != STATE_VERSION or state.get('inputs') != state_inputs():
+        print("State snapshot is missing or outdated, doing a full start")
+        return None
+    return state
 
-def clean_files():
-    def _cleanup():
-        time.sleep(90)
-        files_to_delete = [boot_log_path, config_path, list_path, web_path, bot_path]
-        
-        for file in files_to_delete:
+def save_state(nodes):
+    global saved_state
+    state = {
+        "version": STATE_VERSION,
+        "inputs": state_inputs(),
+        "saved_at": int(time.time()),
+        "argo_domain": link_inputs[0],
+        "isp": link_inputs[1],
+        "isp_expires_at": time.time() + isp_cache[1] - time.monotonic() if isp_cache else 0,
+        "nodes": nodes,
+        "links": current_links(),
+    }
+    with state_lock:
+        state["synced"] = synced_links
+        saved_state = state
+        write_file_atomic(state_path, json.dumps(state, ensure_ascii=False))
+
+def mark_synced(added=(), removed=(), replace=None):
+    # 只由上报任务在请求成功后调用
+    global synced_links
+    with state_lock:
+        if replace is not None:
+            synced_links = list(replace)
+        else:
+            synced_links = [link for link in synced_links if link not in removed]
+            synced_links += [link for link in added if link not in synced_links]
+        if saved_state is not None:
+            saved_state["synced"] = synced_links
+            write_file_atomic(state_path, json.dumps(saved_state, ensure_ascii=False))
+
+def resync_upstream():
+    # 快照有效时，上游缺什么补什么；返回是否有需要发送的请求
+    if not UPLOAD_URL:
+        return False
+    if PROJECT_URL:
+        if set(synced_links) == set(subscription_urls()):
+            return False
+        enqueue_outbound('upload_nodes', upload_nodes)
+        return True
+    if set(synced_links) == set(current_links()):
+        return False
+    sync_node_links(synced_links, current_links())
+    return True
+
+def restore_state(state):
+    global isp_cache, link_inputs, synced_links
+    synced_links = state.get('synced', [])
+    remaining = state['isp_expires_at'] - time.time()
+    if remaining > 0:
+        isp_cache = (state['isp'], time.monotonic() + remaining)
+    # 临时隧道每次启动都会换域名，旧链接不可用，只在固定隧道下直接提供
+    if ARGO_AUTH and ARGO_DOMAIN:
+        link_inputs = (state['argo_domain'], state['isp'])
+        publish_nodes(state['nodes'])
+        print(f"Serving the subscription saved at {formatdate(state['saved_at'], usegmt=True)}")
+
+# 热重载：重新读取 ENV_FILE，只在配置变化时重启 xray，隧道和订阅服务不中断
+RELOADABLE_SETTINGS = {
+    'UUID': str,
+    'NAME': str,
+    'CFIP': str,
+    'CFPORT': int,
+    'TUNING_PROFILE': lambda value: choose_setting('TUNING_PROFILE', value, TUNING_PROFILES, 'balanced'),
+    'USERS': str,
+    'BLOCK_RULES': str,
+    'DNS_SERVERS': str,
+    'DNS_QUERY_STRATEGY': lambda value: choose_setting('DNS_QUERY_STRATEGY', value, DNS_QUERY_STRATEGIES, 'UseIP'),
+    'DNS_DISABLE_CACHE': lambda value: value.lower() == 'true',
+    'DNS_HOSTS': str,
+    'FREEDOM_DOMAIN_STRATEGY': lambda value: choose_setting('FREEDOM_DOMAIN_STRATEGY', value, FREEDOM_DOMAIN_STRATEGIES, 'UseIP'),
+}
+# 枚举类的设置在读入时校验并规范化一次，生成配置时直接使用
+for name in ('TUNING_PROFILE', 'DNS_QUERY_STRATEGY', 'FREEDOM_DOMAIN_STRATEGY'):
+    globals()[name] = RELOADABLE_SETTINGS[name](globals()[name])
+main_loop = None
+reload_lock = None
+
+def read_env_file():
+    settings = {}
+    if not ENV_FILE:
+        return settings
+    with open(ENV_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            key = key.strip()
+            if key.startswith('export '):
+                key = key[7:].strip()
+            settings[key] = value.strip().strip('"\'')
+    return settings
+
+def apply_settings(settings):
+    global CFIP_CANDIDATES, ranked_endpoints
+    changed = []
+    for name, parse in RELOADABLE_SETTINGS.items():
+        if name not in settings:
+            continue
+        value = parse(settings[name])
+        if globals()[name] != value:
+            globals()[name] = value
+            changed.append(name)
+
+    if 'CFIP' in changed or 'CFPORT' in changed:
+        CFIP_CANDIDATES = parse_endpoints(CFIP, CFPORT) or [(CFIP, CFPORT)]
+        ranked_endpoints = list(CFIP_CANDIDATES)
+        edge_latencies.clear()
+
+    ignored = [name for name in settings if name not in RELOADABLE_SETTINGS and os.environ.get(name) != settings[name]]
+    if ignored:
+        print(f"{ENV_FILE}: {', '.join(ignored)} only take effect after a restart")
+    return changed
+
+async def reload_proxy(source):
+    global edge_probe_task
+    async with reload_lock:
+        started = time.perf_counter()
+        try:
+            changed = apply_settings(await asyncio.to_thread(read_env_file))
+            if await asyncio.to_thread(refresh_users):
+                changed.append('users')
+        except (OSError, ValueError) as e:
+            print(f"Reload ({source}) failed: {e}")
+            return False
+
+        ready = True
+        if json.dumps(build_config(), ensure_ascii=False, indent=2) != applied_config:
+            await asyncio.to_thread(write_config)
             try:
-                if os.path.exists(file):
-                    if os.path.isdir(file):
-                        shutil.rmtree(file)
-                    else:
-                        os.remove(file)
-            except:
-                pass
-        
-        print('\033c', end='')
-        print('App is running')
-        print('Thank you for using this script, enjoy!')
+                ready = await web_process.restart()
+            except Exception as e:
+                print(f"Error restarting web: {e}")
+                ready = False
+
+        if link_inputs:
+            await republish_nodes()
+            if len(CFIP_CANDIDATES) > 1 and (edge_probe_task is None or edge_probe_task.done()):
+                edge_probe_task = asyncio.ensure_future(edge_prober())
+
+        print(f"Reloaded ({source}) in {(time.perf_counter() - started) * 1000:.0f}ms, changed: {', '.join(changed) or 'nothing'}")
+        return ready
+
+def schedule_reload(source):
+    asyncio.ensure_future(reload_proxy(source))
+
+# SIGTERM/SIGINT 时先停掉 xray 和所有 cloudflared 副本再退出，避免子进程成为孤儿
+shutting_down = False
+
+def schedule_shutdown(source):
+    global shutting_down
+    if shutting_down:
+        return
+    shutting_down = True
+    asyncio.ensure_future(shutdown(source))
+
+async def shutdown(source):
+    print(f"Shutting down ({source}), stopping child processes")
+    children = [web_process] + bot_processes + ([transport_probe] if transport_probe else [])
+    await asyncio.gather(*(child.stop() for child in children), return_exceptions=True)
+    asyncio.get_running_loop().stop()
+
+def remove_runtime_files():
+    files_to_delete = [boot_log_path, config_path, list_path, web_path, bot_path]
     
-    threading.Thread(target=_cleanup, daemon=True).start()
+    for file in files_to_delete:
+        try:
+            if os.path.exists(file):
+                if os.path.isdir(file):
+                    shutil.rmtree(file)
+                else:
+                    os.remove(file)
+        except:
+            pass
     
-async def start_server():
-    delete_nodes()
+    print('\033c', end='')
+    print('App is running')
+    print('Thank you for using this script, enjoy!')
+
+def clean_files():
+    asyncio.get_running_loop().call_later(90, remove_runtime_files)
+    
+startup_started = 0.0
+phase_timings = {}
+
+async def run_phase(name, func, *args):
+    started = time.perf_counter()
+    try:
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args)
+        return await asyncio.to_thread(func, *args)
+    finally:
+        phase_timings[name] = (started - startup_started, time.perf_counter() - started)
+
+def start_phase(name, func, *args, after=()):
+    async def runner():
+        results = await asyncio.gather(*after)
+        if False in results:
+            print(f"Skipping {name}: a previous step failed")
+            return False
+        try:
+            return await run_phase(name, func, *args)
+        except Exception as e:
+            print(f"Error in {name}: {e}")
+            return False
+    return asyncio.ensure_future(runner())
+
+def read_memory_usage():
+    usage = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    usage[line[:5]] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return usage.get('VmRSS', 0), usage.get('VmHWM', 0)
+
+def report_phase_timings():
+    print("Startup phases (offset / duration):")
+    for name, (offset, duration) in sorted(phase_timings.items(), key=lambda item: item[1][0]):
+        print(f"  {name:<16} +{offset * 1000:6.0f}ms {duration * 1000:7.0f}ms")
+    print(f"  {'total':<16} {(time.perf_counter() - startup_started) * 1000:15.0f}ms")
+    rss, peak = read_memory_usage()
+    print(f"Import time {IMPORT_SECONDS * 1000:.0f}ms, RSS {rss / 1048576:.1f}MiB (peak {peak / 1048576:.1f}MiB), {threading.active_count()} threads")
+
+def prepare_directory():
     cleanup_old_files()
     create_directory()
-    argo_type()
-    await download_files_and_run()
-    add_visit_task()
-    
-    server_thread = Thread(target=run_server)
-    server_thread.daemon = True
-    server_thread.start()   
-    
+
+async def start_http_server():
+    if SERVER_MODE == 'thread':
+        server_thread = Thread(target=run_server)
+        server_thread.daemon = True
+        server_thread.start()
+    else:
+        await start_async_server()
+
+async def start_server():
+    global startup_started, stats_task, health_task, edge_probe_task, domain_watch_task, main_loop, reload_lock, republish_lock
+    startup_started = time.perf_counter()
+    phase_timings.clear()
+    main_loop = asyncio.get_running_loop()
+    reload_lock = asyncio.Lock()
+    republish_lock = asyncio.Lock()
+    try:
+        apply_settings(read_env_file())
+    except (OSError, ValueError) as e:
+        print(f"Error reading {ENV_FILE}: {e}")
+    try:
+        refresh_users()
+    except (OSError, ValueError) as e:
+        print(f"Error loading users, serving only the default user: {e}")
+        users[:] = [User(NAME, UUID, SUB_PATH)]
+    print(f"Serving {len(users)} user(s)")
+    try:
+        main_loop.add_signal_handler(signal.SIGHUP, schedule_reload, 'SIGHUP')
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            main_loop.add_signal_handler(signum, schedule_shutdown, signal.Signals(signum).name)
+    except (NotImplementedError, RuntimeError):
+        pass
+
+    architecture = get_system_architecture()
+    files_to_download = get_files_for_architecture(architecture)
+    if not files_to_download:
+        print("Can't find a file for the current architecture")
+        return
+
+    # 没有可用快照时，旧节点在生成新 sub.txt 之前读出，删除请求和其他上报一样在后台队列里发送
+    start_outbound_worker()
+    state = load_state()
+    if state is None:
+        delete_nodes()
+    await run_phase('cleanup', prepare_directory)
+    if state:
+        await run_phase('warm_state', restore_state, state)
+
+    server = start_phase('http_server', start_http_server)
+    health_task = asyncio.ensure_future(health_checker())
+    enqueue_outbound('visit_task', add_visit_task)
+    meta = start_phase('meta', get_isp)
+    tunnel_config = start_phase('tunnel_config', argo_type)
+    xray_config = start_phase('xray_config', write_config)
+    downloads = {
+        file_info["fileName"]: start_phase(f"download_{file_info['fileName']}", download_file, file_info["fileName"], file_info["fileUrl"], architecture)
+        for file_info in files_to_download
+    }
+
+    web = start_phase('start_web', start_web, after=[downloads['web'], xray_config])
+    if METRICS_TOKEN:
+        stats_task = asyncio.ensure_future(scrape_xray_stats())
+    bot = start_phase('start_bot', start_bot, after=[downloads['bot'], tunnel_config])
+    domain = start_phase('argo_domain', extract_domains, after=[bot])
+
+    argo_domain, ISP = await asyncio.gather(domain, meta)
+    if argo_domain:
+        await run_phase('links', generate_links, argo_domain, ISP)
+        if state is None:
+            enqueue_outbound('upload_nodes', upload_nodes)
+            enqueue_outbound('send_telegram', send_telegram)
+        else:
+            if not resync_upstream():
+                print("Upstream already has the current nodes, skipping upstream sync")
+            if set(state['links']) != set(current_links()):
+                enqueue_outbound('send_telegram', send_telegram)
+        if len(CFIP_CANDIDATES) > 1:
+            edge_probe_task = asyncio.ensure_future(edge_prober())
+        if not (ARGO_AUTH and ARGO_DOMAIN):
+            domain_watch_task = asyncio.ensure_future(watch_argo_domain(argo_domain))
+    elif False in await asyncio.gather(*downloads.values()):
+        print("Error downloading files")
+
+    await asyncio.gather(server, web)
+    report_phase_timings()
+    health = await tunnel_health()
+    print(f"Tunnel connectors: {health['running']}/{len(bot_processes)} running, {health['registered']} registered, {health['connections']} edge connections")
+    print(f"Running done！")
+    print(f"\nLogs will be delete in 90 seconds")
+
     clean_files()
     
 def run_server():
-    server = HTTPServer(('0.0.0.0', PORT), RequestHandler)
+    server = ThreadingHTTPServer(('0.0.0.0', PORT), RequestHandler)
     print(f"Server is running on port {PORT}")
-    print(f"Running done！")
-    print(f"\nLogs will be delete in 90 seconds")
     server.serve_forever()
     
+def new_event_loop():
+    if SERVER_MODE != 'thread' and not LOW_FOOTPRINT:
+        try:
+            import uvloop
+            return uvloop.new_event_loop()
+        except ImportError:
+            print("uvloop is not installed, using the default asyncio loop")
+    return asyncio.new_event_loop()
+
 def run_async():
-    loop = asyncio.new_event_loop()
+    loop = new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(start_server()) 
-    
-    while True:
-        time.sleep(3600)
+    if LOW_FOOTPRINT:
+        from concurrent.futures import ThreadPoolExecutor
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=2))
+    try:
+        loop.run_until_complete(start_server())
+    except RuntimeError:
+        # 启动过程中收到 SIGTERM/SIGINT 时 shutdown() 会提前停掉事件循环
+        if not shutting_down:
+            raise
+    else:
+        loop.run_forever()
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
         
 if __name__ == "__main__":
     run_async()
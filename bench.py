@@ -0,0 +1,553 @@
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import asyncio
+import argparse
+import platform
+import tempfile
+import importlib
+import threading
+import subprocess
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 离线基准测试：二进制下载、UPLOAD_URL、Telegram、Cloudflare meta 全部指向本地桩服务器，
+# web/bot 换成行为相近的桩程序，测量冷启动、热启动和 /{SUB_PATH} 的吞吐与延迟。
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+SUB_PATH = 'bench'
+UUID = '0b3f7a4e-5c1d-4e2a-9f60-8d2b1c3e4f50'
+METRICS_TOKEN = 'bench'
+
+# 桩 xray：监听配置里的所有入口，metrics-in 入口返回 expvar 统计
+STUB_WEB = '''#!{python}
+import sys, json, socket, selectors
+config = json.load(open(sys.argv[sys.argv.index('-c') + 1]))
+selector = selectors.DefaultSelector()
+for inbound in config['inbounds']:
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((inbound.get('listen', '0.0.0.0'), inbound['port']))
+    server.listen(128)
+    selector.register(server, selectors.EVENT_READ, inbound.get('tag'))
+stats = {{"inbound": {{inbound['tag']: {{"uplink": 0, "downlink": 0}} for inbound in config['inbounds'] if inbound.get('tag')}}}}
+while True:
+    for key, _ in selector.select():
+        conn, _ = key.fileobj.accept()
+        if key.data == 'metrics-in':
+            try:
+                conn.settimeout(1)
+                conn.recv(4096)
+                conn.sendall(b'HTTP/1.0 200 OK\\r\\n\\r\\n' + json.dumps({{"stats": stats}}).encode())
+            except OSError:
+                pass
+        conn.close()
+'''
+
+# 桩 cloudflared：延迟 BENCH_TUNNEL_DELAY 秒后在 --logfile 写入临时域名，并在 --metrics 上提供 /ready
+STUB_BOT = '''#!{python}
+import os, sys, json, time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+args = sys.argv
+delay = float(os.environ.get('BENCH_TUNNEL_DELAY', '0.5'))
+started = time.time()
+time.sleep(delay)
+if '--logfile' in args:
+    with open(args[args.index('--logfile') + 1], 'a') as f:
+        f.write(f"INF |  https://bench-{{os.getpid()}}.trycloudflare.com  |\\n")
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({{"status": 200, "readyConnections": 4}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, format, *args):
+        pass
+if '--metrics' in args:
+    host, port = args[args.index('--metrics') + 1].rsplit(':', 1)
+    HTTPServer((host, int(port)), Handler).serve_forever()
+while True:
+    time.sleep(3600)
+'''
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def build_stub_binaries(size_mb):
+    padding = '#' + 'x' * max(0, int(size_mb * 1024 * 1024) - 1) + '\n'
+    return {
+        '/web': (STUB_WEB.format(python=sys.executable) + padding).encode('utf-8'),
+        '/2go': (STUB_BOT.format(python=sys.executable) + padding).encode('utf-8'),
+    }
+
+def start_stub_server(binaries, latency):
+    calls = {}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def reply(self, status, body, content_type='application/json'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', f'"{len(body)}"')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def record(self):
+            path = self.path.split('?', 1)[0]
+            calls[path] = calls.get(path, 0) + 1
+            if latency:
+                time.sleep(latency)
+
+        def do_GET(self):
+            self.record()
+            if self.path in binaries:
+                self.reply(200, binaries[self.path], 'application/octet-stream')
+            elif self.path == '/meta':
+                self.reply(200, json.dumps({"asn": 64500, "asOrganization": "Bench Net", "colo": "LAB", "country": "ZZ"}).encode())
+            else:
+                self.reply(404, b'')
+
+        def do_POST(self):
+            self.record()
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            self.reply(200, b'{"ok": true}')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, calls
+
+def app_env(args, work_dir, stub_url, port):
+    env = dict(os.environ)
+    env.update({
+        'FILE_PATH': os.path.join(work_dir, 'cache'),
+        'PORT': str(port),
+        'SUB_PATH': SUB_PATH,
+        'UUID': UUID,
+        'NAME': 'Bench',
+        'ARGO_PORT': str(free_port()),
+        'ARGO_METRICS_PORT': str(free_port()),
+        'XRAY_API_PORT': str(free_port()),
+        'XRAY_METRICS_PORT': str(free_port()),
+        'BIN_BASE_URL': stub_url,
+        'META_URL': f'{stub_url}/meta',
+        'UPLOAD_URL': stub_url,
+        'TELEGRAM_API': stub_url,
+        'BOT_TOKEN': 'bench',
+        'CHAT_ID': '1',
+        'STATS_INTERVAL': '1',
+        'METRICS_TOKEN': METRICS_TOKEN,
+        'SERVER_MODE': args.server_mode,
+        'BENCH_TUNNEL_DELAY': str(args.tunnel_delay),
+        'LOW_FOOTPRINT': 'true' if args.low_footprint else 'false',
+    })
+    for name in ('ARGO_AUTH', 'ARGO_DOMAIN', 'PROJECT_URL', 'AUTO_ACCESS', 'SERVER_PORT'):
+        env.pop(name, None)
+    return env
+
+def http_get(port, path, timeout=1.0, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+def start_app(env, log_path):
+    log_file = open(log_path, 'ab')
+    process = subprocess.Popen([sys.executable, APP_PATH], env=env, stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
+    log_file.close()
+    return process
+
+def stop_app(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+def wait_for_subscription(process, port, timeout):
+    started = time.perf_counter()
+    first_response = None
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited with code {process.returncode}")
+        try:
+            status, _ = http_get(port, f'/{SUB_PATH}', timeout=0.5)
+            if first_response is None:
+                first_response = time.perf_counter() - started
+            if status == 200:
+                return first_response, time.perf_counter() - started
+        except OSError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"subscription was not served within {timeout}s")
+
+def read_metrics(port):
+    _, body = http_get(port, '/metrics', headers={'Authorization': f'Bearer {METRICS_TOKEN}'})
+    phases = {}
+    process = {}
+    for line in body.decode('utf-8').splitlines():
+        if line.startswith('startup_phase_seconds{'):
+            name = line.split('"')[1]
+            phases[name] = round(float(line.rsplit(' ', 1)[1]) * 1000, 2)
+        elif line.startswith('process_'):
+            name, value = line.rsplit(' ', 1)
+            process[name] = float(value)
+    return phases, process
+
+def measure_start(args, env, work_dir, label):
+    process = start_app(env, os.path.join(work_dir, f'{label}.log'))
+    try:
+        first_response, ready = wait_for_subscription(process, int(env['PORT']), args.timeout)
+        # 阶段计时在启动流程结束后才完整
+        time.sleep(0.2)
+        phases, process_metrics = read_metrics(int(env['PORT']))
+        result = {
+            "http_ready_ms": round(first_response * 1000, 2),
+            "subscription_ready_ms": round(ready * 1000, 2),
+            "import_ms": round(process_metrics.get('process_import_seconds', 0) * 1000, 2),
+            "rss_mib": round(process_metrics.get('process_resident_memory_bytes', 0) / 1048576, 2),
+            "threads": int(process_metrics.get('process_threads', 0)),
+            "phases_ms": phases,
+        }
+    except Exception:
+        stop_app(process)
+        raise
+    return process, result
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+async def load_test(port, path, concurrency, duration, headers=''):
+    latencies = []
+    errors = 0
+    request = f'GET {path} HTTP/1.1\r\nHost: bench\r\n{headers}\r\n'.encode('latin-1')
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        reader = writer = None
+        while time.perf_counter() < deadline:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                started = time.perf_counter()
+                writer.write(request)
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.split(b'\r\n')[1:]:
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                latencies.append(time.perf_counter() - started)
+                if not head.startswith((b'HTTP/1.1 200', b'HTTP/1.1 304')):
+                    errors += 1
+                if b'connection: close' in head.lower():
+                    writer.close()
+                    writer = None
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                errors += 1
+                if writer is not None:
+                    writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+def run_benchmark(args):
+    binaries = build_stub_binaries(args.binary_size)
+    stub_server, calls = start_stub_server(binaries, args.stub_latency / 1000)
+    stub_url = f'http://127.0.0.1:{stub_server.server_address[1]}'
+
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    env = app_env(args, work_dir, stub_url, free_port())
+    results = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "server_mode": args.server_mode,
+        "low_footprint": args.low_footprint,
+        "binary_size_mb": args.binary_size,
+        "work_dir": work_dir,
+    }
+
+    process, results["cold_start"] = measure_start(args, env, work_dir, 'cold')
+    stop_app(process)
+    print(f"cold start: subscription ready in {results['cold_start']['subscription_ready_ms']}ms, "
+          f"import {results['cold_start']['import_ms']}ms, RSS {results['cold_start']['rss_mib']}MiB")
+
+    # 热启动：同一个 FILE_PATH，二进制缓存已就绪
+    process, results["warm_start"] = measure_start(args, env, work_dir, 'warm')
+    print(f"warm start: subscription ready in {results['warm_start']['subscription_ready_ms']}ms")
+    try:
+        port = int(env['PORT'])
+        results["load"] = {
+            "identity": asyncio.run(load_test(port, f'/{SUB_PATH}', args.concurrency, args.duration)),
+            "gzip": asyncio.run(load_test(port, f'/{SUB_PATH}', args.concurrency, args.duration, 'Accept-Encoding: gzip\r\n')),
+        }
+        for name, load in results["load"].items():
+            print(f"load ({name}): {load['requests_per_s']} req/s, p50 {load['p50_ms']}ms, p99 {load['p99_ms']}ms, {load['errors']} errors")
+    finally:
+        stop_app(process)
+        stub_server.shutdown()
+
+    results["stub_calls"] = calls
+    return results
+
+# ingress 场景：用真实 xray 和 app.build_config() 生成的配置，比较两种 tunnel.yml 入口下
+# cloudflared 到 xray 的每连接开销：fallback 经 ARGO_PORT 的 VLESS 入口回落，direct 直连 ws 入口
+def build_xray_config(work_dir, overrides=None, extra_inbounds=()):
+    os.environ.update({
+        'FILE_PATH': os.path.join(work_dir, 'cache'),
+        'UUID': UUID,
+        'ARGO_PORT': str(free_port()),
+        'XRAY_API_PORT': str(free_port()),
+        'XRAY_METRICS_PORT': str(free_port()),
+    })
+    os.environ.update(overrides or {})
+    if os.path.dirname(APP_PATH) not in sys.path:
+        sys.path.insert(0, os.path.dirname(APP_PATH))
+    # 每次按当前环境变量重新执行 app 的模块级配置
+    app = importlib.reload(sys.modules['app']) if 'app' in sys.modules else importlib.import_module('app')
+    app.refresh_users()
+    config = app.build_config()
+    config["inbounds"].extend(extra_inbounds)
+    config_path = os.path.join(work_dir, 'config.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    return app, config_path
+
+def start_xray(xray, config_path, ports, timeout):
+    process = subprocess.Popen([xray, 'run', '-c', config_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.perf_counter() + timeout
+    pending = list(ports)
+    while pending:
+        if process.poll() is not None:
+            raise RuntimeError(f"xray exited with code {process.returncode}")
+        if time.perf_counter() > deadline:
+            process.kill()
+            raise RuntimeError(f"xray ports {pending} not ready within {timeout}s")
+        try:
+            socket.create_connection(('127.0.0.1', pending[0]), 0.2).close()
+            pending.pop(0)
+        except OSError:
+            time.sleep(0.05)
+    return process
+
+def cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+async def websocket_connect_test(port, path, connections, concurrency):
+    latencies = []
+    errors = 0
+    request = (f'GET {path} HTTP/1.1\r\nHost: bench\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+               'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n').encode('latin-1')
+    remaining = connections
+
+    async def client():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            writer = None
+            started = time.perf_counter()
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(request)
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+                if b' 101 ' in head.split(b'\r\n', 1)[0]:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                errors += 1
+            finally:
+                if writer is not None:
+                    writer.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    latencies.sort()
+    return {
+        "connections": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+def run_ingress_benchmark(args):
+    if not args.xray:
+        raise SystemExit('--scenario ingress needs --xray pointing at an xray binary')
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    app, config_path = build_xray_config(work_dir)
+    results = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "connections": args.connections,
+        "concurrency": args.concurrency,
+    }
+
+    targets = {"fallback": app.ARGO_PORT, "direct": dict(app.WS_INBOUNDS)['/vless-argo']}
+    process = start_xray(args.xray, config_path, list(targets.values()), args.timeout)
+    try:
+        for name, port in targets.items():
+            path = app.ws_path('/vless-argo')
+            asyncio.run(websocket_connect_test(port, path, min(200, args.connections), args.concurrency))
+            cpu_before = cpu_seconds(process.pid)
+            started = time.perf_counter()
+            result = asyncio.run(websocket_connect_test(port, path, args.connections, args.concurrency))
+            result["connections_per_s"] = round(result["connections"] / (time.perf_counter() - started), 1)
+            result["xray_cpu_ms_per_1k"] = round((cpu_seconds(process.pid) - cpu_before) * 1000 * 1000 / max(1, result["connections"]), 2)
+            results[name] = result
+            print(f"ingress ({name}): p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, "
+                  f"{result['connections_per_s']} conn/s, xray CPU {result['xray_cpu_ms_per_1k']}ms per 1k connections, {result['errors']} errors")
+    finally:
+        process.kill()
+        process.wait()
+    return results
+
+# dns 场景：每种 DNS 设置启动一个新的 xray（缓存为空），经本地 HTTP 代理入口走 direct 出口访问一组域名，
+# 分别记录首次连接（含解析）和第二次连接到首字节的耗时
+DNS_VARIANTS = {
+    'default': {},
+    'doh': {'DNS_SERVERS': 'https://1.1.1.1/dns-query,https://8.8.8.8/dns-query'},
+    'ipv4': {'DNS_QUERY_STRATEGY': 'UseIPv4'},
+    'no-cache': {'DNS_DISABLE_CACHE': 'true'},
+    'system': {'FREEDOM_DOMAIN_STRATEGY': 'AsIs'},
+}
+DNS_TARGETS = 'example.com,cloudflare.com,github.com,wikipedia.org,apple.com,microsoft.com,amazon.com,bing.com'
+DNS_SETTINGS = ('DNS_SERVERS', 'DNS_QUERY_STRATEGY', 'DNS_DISABLE_CACHE', 'DNS_HOSTS', 'FREEDOM_DOMAIN_STRATEGY')
+
+def proxy_first_byte(proxy_port, host, timeout):
+    started = time.perf_counter()
+    with socket.create_connection(('127.0.0.1', proxy_port), timeout) as conn:
+        conn.settimeout(timeout)
+        conn.sendall(f'GET http://{host}/ HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+        if not conn.recv(1):
+            raise OSError('connection closed without a response')
+    return time.perf_counter() - started
+
+def summarize(latencies, errors):
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+    }
+
+def run_dns_benchmark(args):
+    if not args.xray:
+        raise SystemExit('--scenario dns needs --xray pointing at an xray binary')
+    targets = [host.strip() for host in args.dns_targets.split(',') if host.strip()]
+    results = {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "targets": targets,
+        "variants": {},
+    }
+    baseline = {name: os.environ[name] for name in DNS_SETTINGS if name in os.environ}
+
+    for name in args.dns_variants.split(','):
+        if name not in DNS_VARIANTS:
+            raise SystemExit(f"unknown DNS variant {name}, choose from {', '.join(DNS_VARIANTS)}")
+        for setting in DNS_SETTINGS:
+            os.environ.pop(setting, None)
+        os.environ.update(baseline)
+
+        work_dir = tempfile.mkdtemp(prefix='bench-')
+        proxy_port = free_port()
+        proxy_inbound = {"tag": "bench-in", "listen": "127.0.0.1", "port": proxy_port, "protocol": "http"}
+        app, config_path = build_xray_config(work_dir, DNS_VARIANTS[name], [proxy_inbound])
+        process = start_xray(args.xray, config_path, [proxy_port], args.timeout)
+        try:
+            passes = {}
+            for label in ('first', 'repeat'):
+                latencies, errors = [], 0
+                for host in targets:
+                    try:
+                        latencies.append(proxy_first_byte(proxy_port, host, args.timeout))
+                    except OSError:
+                        errors += 1
+                passes[label] = summarize(latencies, errors)
+        finally:
+            process.kill()
+            process.wait()
+
+        results["variants"][name] = {"settings": dict(DNS_VARIANTS[name]), "dns": app.build_dns(), **passes}
+        print(f"dns ({name}): first connect p50 {passes['first']['p50_ms']}ms, mean {passes['first']['mean_ms']}ms; "
+              f"repeat p50 {passes['repeat']['p50_ms']}ms; {passes['first']['errors'] + passes['repeat']['errors']} errors")
+    return results
+
+def write_results(results, output):
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline startup and subscription benchmarks for app.py')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--server-mode', default='async', choices=['async', 'thread'])
+    parser.add_argument('--low-footprint', action='store_true', help='run the app with LOW_FOOTPRINT=true')
+    parser.add_argument('--binary-size', type=float, default=4.0, help='size of each stub binary in MiB')
+    parser.add_argument('--stub-latency', type=float, default=0.0, help='added latency of every stub endpoint in ms')
+    parser.add_argument('--tunnel-delay', type=float, default=0.5, help='seconds before the stub tunnel reports its domain')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--scenario', default='start', choices=['start', 'ingress', 'dns'],
+                        help='start: cold/warm start and subscription load; ingress: fallback vs direct tunnel ingress; '
+                             'dns: first-connect latency per DNS setting (needs network access)')
+    parser.add_argument('--xray', help='path to a real xray binary, used by the ingress and dns scenarios')
+    parser.add_argument('--connections', type=int, default=2000, help='websocket connections per ingress mode')
+    parser.add_argument('--dns-variants', default=','.join(DNS_VARIANTS), help='comma separated DNS settings to compare')
+    parser.add_argument('--dns-targets', default=DNS_TARGETS, help='comma separated hostnames to connect to')
+    args = parser.parse_args()
+
+    if args.scenario == 'ingress':
+        write_results(run_ingress_benchmark(args), args.output)
+    elif args.scenario == 'dns':
+        write_results(run_dns_benchmark(args), args.output)
+    else:
+        write_results(run_benchmark(args), args.output)
+
+if __name__ == '__main__':
+    main()